@@ -22,12 +22,19 @@
 # SOFTWARE.
 ################################################################################
 import builtins
-from .pager import Pager
+from .pager import Pager, DEFAULT_CACHE_SIZE
+from .vfs import BaseVFS, FileVFS, MmapVFS, MemoryVFS, BusyError, get_vfs
 from .schema import TableSchema, IndexSchema, ViewSchema
-from .btree import TableLeafNode, TableInteriorNode, IndexInteriorNode, swap_node
+from .record import Row
+from .btree import (
+    TableInteriorNode, IndexInteriorNode, build_btree, free_btree, swap_node, DEFAULT_FILL_FACTOR,
+    BTREE_PAGE_TYPE_LEAF_TABLE, BTREE_PAGE_TYPE_LEAF_INDEX
+)
 
 
-__all__ = ("Database", "open")
+__all__ = ("Database", "open", "Row", "BaseVFS", "FileVFS", "MmapVFS", "MemoryVFS", "BusyError")
+
+ROW_FORMATS = ("dict", "tuple", "namedtuple", "row")
 
 
 class IntegrityError(Exception):
@@ -38,14 +45,38 @@ class IntegrityError(Exception):
         return self.message
 
 
+class _IndexSortKey:
+    "sort key of index record (key + [rowid]) with ASC/DESC orders"
+    __slots__ = ("values", "orders")
+
+    def __init__(self, values, orders):
+        self.values = values
+        self.orders = orders
+
+    def __lt__(self, other):
+        for v, w, order in zip(self.values, other.values, self.orders):
+            if v != w:
+                return (v < w) if order == 1 else (v > w)
+        return False
+
+
 class Database:
-    def __init__(self, fileobj, raise_integirty_error=True):
+    def __init__(
+        self, fileobj, raise_integirty_error=True,
+        cache_size=DEFAULT_CACHE_SIZE, mmap=False, journal_mode="delete", vfs=None, row_format="dict", name=None
+    ):
+        if row_format not in ROW_FORMATS:
+            raise ValueError("row_format={}".format(row_format))
         self.fileobj = fileobj
         self.raise_integirty_error = raise_integirty_error
-        self.pager = Pager(self)
+        self.row_format = row_format
+        if vfs is None:
+            vfs = "mmap" if mmap else "file"
+        self.pager = Pager(self, get_vfs(fileobj, vfs, name), cache_size, journal_mode)
         self.tables = {}
         self.indexes = {}
         self.views = {}
+        self._rightmost_cache = {}      # table pgno -> [rightmost path pgno list, max rowid]
         for _, r in self.pager.records(1):
             # type, name, table_name, pgno, sql
             if r[0] == 'table':
@@ -80,7 +111,7 @@ class Database:
         return None
 
     def get_index_schema_by_column_names(self, table_name, column_names):
-        for idx in self.indexes[table_name]:
+        for idx in self.indexes.get(table_name, []):
             if tuple([c.name for c in idx.columns]) == tuple(column_names):
                 return idx
         return None
@@ -93,12 +124,32 @@ class Database:
         "IndexSchema list by table name"
         return self.indexes.get(table_name)
 
-    def fetch_all(self, table_name):
-        "Fetch all table records"
+    def _converter(self, table_schema, columns, row_format):
+        """(record positions, converter, lazy) of row_format.
+        row_format None means the row_format of the database.
+        """
+        if row_format is None:
+            row_format = self.row_format
+        if row_format == "dict":
+            return table_schema.projection(columns) + (False, )
+        elif row_format == "tuple":
+            return table_schema.tuple_projection(columns) + (False, )
+        elif row_format == "namedtuple":
+            return table_schema.tuple_projection(columns, named=True) + (False, )
+        elif row_format == "row":
+            return table_schema.row_projection(columns) + (True, )
+        raise ValueError("row_format={}".format(row_format))
+
+    def fetch_all(self, table_name, reverse=False, columns=None, row_format=None):
+        """Fetch all table records. If reverse is True, from the last record
+        If columns is given, only the columns are decoded and fetched.
+        row_format overrides the row_format of the database.
+        """
         table_schema = self.table_schema(table_name)
-        return self.pager.records(table_schema.pgno, table_schema.row_converter)
+        positions, converter, lazy = self._converter(table_schema, columns, row_format)
+        return self.pager.records(table_schema.pgno, converter, reverse, positions, lazy)
 
-    def _filter_by_index(self, index_schema, key_dict):
+    def _filter_by_index(self, index_schema, key_dict, columns=None, row_format=None):
         "Filter by index column and Fetch records"
         key_column_names = [c.name for c in index_schema.columns]
         if set(key_column_names) != set(key_dict.keys()):
@@ -111,37 +162,45 @@ class Database:
             index_schema.orders,
             list(range(len(index_schema.columns)))
         ):
-            yield self.get_by_rowid(index_schema.table_name, r[-1])
+            yield self.get_by_rowid(index_schema.table_name, r[-1], columns, row_format)
 
-    def _get_by_rowid(self, table_schema, rowid):
+    def _get_by_rowid(self, table_schema, rowid, columns=None, row_format="dict"):
+        positions, converter, lazy = self._converter(table_schema, columns, row_format)
         try:
-            return next(self.pager.rowid_range_records(table_schema.pgno, rowid, rowid, table_schema.row_converter))
+            return next(self.pager.rowid_range_records(
+                table_schema.pgno, rowid, rowid, converter, positions=positions, lazy=lazy
+            ))
         except StopIteration:
             return None
 
-    def get_by_rowid(self, table_name, rowid):
-        "Get table record by rowid"
+    def get_by_rowid(self, table_name, rowid, columns=None, row_format=None):
+        """Get table record by rowid
+        If columns is given, only the columns are decoded and fetched.
+        row_format overrides the row_format of the database.
+        """
         table_schema = self.table_schema(table_name)
-        return self._get_by_rowid(table_schema, rowid)
+        return self._get_by_rowid(table_schema, rowid, columns, row_format)
 
-    def get_by_pk(self, table_name, value):
-        "Get table record by primary key"
+    def get_by_pk(self, table_name, value, columns=None, row_format=None):
+        """Get table record by primary key
+        If columns is given, only the columns are decoded and fetched.
+        row_format overrides the row_format of the database.
+        """
         table_schema = self.table_schema(table_name)
         index_schema = self._get_primary_key_index(table_name)
         if any([c.is_rowid for c in table_schema.columns]):
-            try:
-                return next(self.pager.rowid_range_records(table_schema.pgno, value, value, table_schema.row_converter))
-            except StopIteration:
-                return None
+            return self._get_by_rowid(table_schema, value, columns, row_format)
         elif table_schema.without_rowid:
             if not isinstance(value, list):
                 value = [value]
+            _, converter, lazy = self._converter(table_schema, columns, row_format)
             g = self.pager.index_range_records(
                 table_schema.pgno,
                 value, value,
                 [1] * len(table_schema.primary_keys),
                 list(range(len(table_schema.primary_keys))),
-                table_schema.row_converter
+                converter,
+                lazy=lazy
             )
             try:
                 return next(g)
@@ -161,120 +220,211 @@ class Database:
                 _, r = next(g)
             except StopIteration:
                 return None
-            return self.get_by_rowid(table_name, r[-1])
+            return self.get_by_rowid(table_name, r[-1], columns, row_format)
 
         return None
 
-    def filter(self, table_name, cond):
+    def filter(self, table_name, cond, columns=None, row_format=None):
+        """Fetch records which match cond dict
+        If columns is given, only the columns are decoded and fetched.
+        row_format overrides the row_format of the database.
+        """
         if index_schema := self.get_index_schema_by_column_names(table_name, cond.keys()):
-            for r in self._filter_by_index(index_schema, cond):
+            for r in self._filter_by_index(index_schema, cond, columns, row_format):
                 yield r
         else:
-            for r in self.fetch_all(table_name):
-                if all([r[1][k] == v for k, v in cond.items()]):
-                    yield r
+            # decode columns in cond first, and whole row only if it matches
+            table_schema = self.table_schema(table_name)
+            cond_positions, cond_converter = table_schema.projection(list(cond.keys()))
+            positions, converter, lazy = self._converter(table_schema, columns, row_format)
+            cursor = self.pager.cursor(table_schema.pgno)
+            valid = cursor.first()
+            while valid:
+                _, r = cursor.row(cond_converter, cond_positions)
+                if all([r[k] == v for k, v in cond.items()]):
+                    yield cursor.row(converter, positions, lazy)
+                valid = cursor.next()
+
+    def _rightmost(self, table_schema):
+        """[rightmost path pgno list, max rowid] of the table.
+        It is kept while inserting in a transaction and cleared by other changes.
+        """
+        rightmost = self._rightmost_cache.get(table_schema.pgno)
+        if rightmost is None:
+            cursor = self.pager.cursor(table_schema.pgno)
+            max_rowid = cursor.rowid if cursor.last() else 0
+            node = self.pager.get_page(table_schema.pgno).get_node()
+            pgnos = [node.pgno]
+            while isinstance(node, TableInteriorNode):
+                node = self.pager.get_page(node.right_most).get_node()
+                pgnos.append(node.pgno)
+            rightmost = self._rightmost_cache[table_schema.pgno] = [pgnos, max_rowid]
+        return rightmost
 
     def _get_next_rowid(self, table_schema):
-        node = self.pager.get_page(table_schema.pgno).get_node()
-        assert isinstance(node, (TableLeafNode, TableInteriorNode))
-        while isinstance(node, TableInteriorNode):
-            node = self.pager.get_page(node.right_most).get_node()
-        if len(node.cells) == 0:
-            return 1
-        return node.cells[-1].rowid + 1
+        return self._rightmost(table_schema)[1] + 1
 
     def _insert1(self, r, table_schema, index_schemas):
         rowid, value_list = table_schema.dict_to_value_list(r)
+        rightmost = self._rightmost(table_schema)
         if rowid is None:
-            rowid = self._get_next_rowid(table_schema)
-
-        table_ancestors, table_leaf, table_leaf_cell_index, found = self.pager.find_rowid_table_path(table_schema.pgno, rowid)
+            rowid = rightmost[1] + 1
 
-        if found:
-            self.rollback()
-            raise ValueError("rowid:{} is exists".format(rowid))
+        if rowid > rightmost[1]:
+            # append to the rightmost leaf without searching
+            nodes = [self.pager.get_page(pgno).get_node() for pgno in rightmost[0]]
+            path = [[node, node.number_of_cells] for node in nodes]
+        else:
+            path = self.pager.cursor(table_schema.pgno).descend(rowid)
+            table_leaf, cell_index = path[-1]
+            if cell_index < table_leaf.number_of_cells and table_leaf._rowid_at(
+                table_leaf.page.data, table_leaf._cell_pointer(cell_index)
+            ) == rowid:
+                self.rollback()
+                raise ValueError("rowid:{} is exists".format(rowid))
 
         # Insert record to TableLeafNode
+        table_leaf, cell_index = path[-1]
         cell_block = table_leaf.to_cell_block(rowid, value_list)
-        cell_index = table_leaf.find_cell_index(rowid)
         if table_leaf.free_cell_size() >= len(cell_block):
-            table_leaf.insert(rowid, cell_index, cell_block)
-        else:   # overflow table leaf
-            new_leaf = table_leaf.split_by_index(cell_index)
-            if new_leaf.number_of_cells == 0:
-                new_leaf.insert(rowid, cell_index, cell_block)
-                if len(table_ancestors) == 0:
-                    parent = TableInteriorNode.new_node(self.pager)
-                    table_leaf, parent = swap_node(parent, table_leaf)
-                    new_leaf, table_leaf = swap_node(table_leaf, new_leaf)
-                    parent.right_most = new_leaf.pgno
-                    parent.insert_node_index(table_leaf, 0)
-                else:
-                    parent = table_ancestors[-1]
-                    parent.insert_node_after(new_leaf, table_ancestors[:-1], table_leaf)
-            else:
-                table_leaf.insert(rowid, cell_index, cell_block)
+            table_leaf.insert_cell_block(cell_index, cell_block)
+        else:
+            table_leaf.insert_and_balance(path[:-1], cell_index, cell_block)
+            # the rightmost path may be changed by split
+            del self._rightmost_cache[table_schema.pgno]
+        rightmost[1] = max(rightmost[1], rowid)
 
         # Insert index to IndexLeafNode
         for index_schema in reversed(index_schemas):
             key = [r[c.name] for c in index_schema.columns]
-            index_ancestors, index_leaf, index_leaf_cell_index, found = self.pager.find_rowid_index_path(
-                index_schema.pgno, key, rowid, index_schema.orders, True
-            )
+            # index record is (key, rowid)
+            path = self.pager.cursor(index_schema.pgno).descend(key + [rowid], index_schema.orders + [1], after=True)
+            index_leaf, cell_index = path[-1]
             cell_block = index_leaf.to_cell_block(rowid, key)
-            cell_index = index_leaf.find_cell_index(key, index_schema)
-            if index_leaf.free_cell_size() < len(cell_block):   # overflow index leaf
-                new_leaf, interior_cell_block = index_leaf.split_by_median()
-                index_leaf.sweep()
-                if len(index_ancestors) == 0:
-                    parent = IndexInteriorNode.new_node(self.pager)
-                    index_leaf, parent = swap_node(parent, index_leaf)
-                    new_leaf, index_leaf = swap_node(index_leaf, new_leaf)
-                    parent.right_most = new_leaf.pgno
-                    parent.insert_cell_block(0, index_leaf.pgno.to_bytes(4, "big") + interior_cell_block)
-                    index_leaf = new_leaf
-                else:
-                    parent = index_ancestors[-1]
-                    if parent.free_cell_size() < len(interior_cell_block):  # overflow index interior
-                        # split parent index interior and retry to find path
-                        parent.split_by_median(index_ancestors[:-1])
-                        # TODO: find index_leaf without find_rowid_index_path()
-                        index_ancestors, index_leaf, index_leaf_cell_index, found = self.pager.find_rowid_index_path(
-                            index_schema.pgno, key, rowid, index_schema.orders, True
-                        )
-                        cell_block = index_leaf.to_cell_block(rowid, key)
-                        cell_index = index_leaf.find_cell_index(key, index_schema)
-            index_leaf.insert(rowid, key, cell_index, cell_block)
+            index_leaf.insert_and_balance(path[:-1], cell_index, cell_block)
 
     def insert(self, table_name, dict_list):
         """insert data
         dict_list is iterator of value dict
         """
         table_schema = self.table_schema(table_name)
-        index_schemas = self.index_schemas(table_name)
+        index_schemas = self.index_schemas(table_name) or []
 
         for r in dict_list:
             # TODO: check constraint
             self._insert1(r, table_schema, index_schemas)
 
-    def _delete_by_rowid(self, table_schema, rowid):
-        table_ancestors, table_leaf, table_leaf_cell_index, found = self.pager.find_rowid_table_path(table_schema.pgno, rowid)
+    def _bulk_rows(self, table_schema, rows, presorted):
+        "(rowid, value_list, row) in rowid order"
+        next_rowid = 1
+        prev_rowid = None
+        records = []
+        for r in rows:
+            rowid, value_list = table_schema.dict_to_value_list(r)
+            if rowid is None:
+                rowid = next_rowid
+            next_rowid = max(next_rowid, rowid + 1)
+            if presorted:
+                if prev_rowid is not None and rowid <= prev_rowid:
+                    raise ValueError("rows are not sorted by rowid:{}".format(rowid))
+                prev_rowid = rowid
+                yield rowid, value_list, r
+            else:
+                records.append((rowid, value_list, r))
+        records.sort(key=lambda rec: rec[0])
+        for rowid, value_list, r in records:
+            if rowid == prev_rowid:
+                raise ValueError("rowid:{} is exists".format(rowid))
+            prev_rowid = rowid
+            yield rowid, value_list, r
+
+    def bulk_load(self, table_name, rows, presorted=False, fill_factor=DEFAULT_FILL_FACTOR):
+        """load rows into an empty table.
+        Table and index pages are built bottom-up from records sorted by rowid and index key.
+        If presorted is True, rows must be ordered by rowid.
+        """
+        table_schema = self.table_schema(table_name)
+        index_schemas = self.index_schemas(table_name) or []
+        if table_schema.without_rowid:
+            raise NotImplementedError("bulk_load WITHOUT ROWID table")
+        if self.pager.cursor(table_schema.pgno).first():
+            raise ValueError("table {} is not empty".format(table_name))
+
+        self._rightmost_cache.pop(table_schema.pgno, None)
+        table_root = self.pager.get_page(table_schema.pgno).get_node()
+        index_entries = [[] for _ in index_schemas]
+
+        def table_cell_blocks():
+            for rowid, value_list, r in self._bulk_rows(table_schema, rows, presorted):
+                for entries, index_schema in zip(index_entries, index_schemas):
+                    entries.append([r[c.name] for c in index_schema.columns] + [rowid])
+                yield table_root.to_cell_block(rowid, value_list)
 
-        if not found:
+        try:
+            build_btree(table_root, table_cell_blocks(), fill_factor)
+            for entries, index_schema in zip(index_entries, index_schemas):
+                orders = index_schema.orders + [1]
+                entries.sort(key=lambda values: _IndexSortKey(values, orders))
+                index_root = self.pager.get_page(index_schema.pgno).get_node()
+                build_btree(
+                    index_root,
+                    (index_root.to_cell_block(values[-1], values[:-1]) for values in entries),
+                    fill_factor
+                )
+        except Exception:
+            self.rollback()
+            raise
+
+    def _delete_index_record(self, index_schema, key, rowid):
+        "delete (key, rowid) record from index B-tree"
+        key = key + [rowid]
+        orders = index_schema.orders + [1]
+        cursor = self.pager.cursor(index_schema.pgno)
+        if not cursor.seek(key, orders) or cursor.compare(key, cursor.record(), orders) != 0:
+            return
+        node, i = cursor.stack[-1]
+        if not isinstance(node, IndexInteriorNode):
+            node.delete(i)
+            node.balance_after_delete(cursor.stack[:-1])
+            return
+
+        # replace interior record with the previous record in the leaf
+        cursor.prev()
+        leaf, _ = cursor.stack[-1]
+        cell_blocks = leaf.cell_blocks()
+        prev_block = cell_blocks.pop()
+        leaf.rebuild(cell_blocks)
+        leaf.balance_after_delete(cursor.stack[:-1])
+
+        # the record may be moved by balancing
+        cursor.seek(key, orders)
+        node, i = cursor.stack[-1]
+        node.cells[i].cell_payload.free_overflow_pages()
+        cell_blocks = node.cell_blocks()
+        if isinstance(node, IndexInteriorNode):
+            prev_block = cell_blocks[i][:4] + prev_block
+            right_most = node.right_most
+        else:
+            right_most = None
+        del cell_blocks[i]
+        node.rebuild(cell_blocks, right_most)
+        node.insert_and_balance(cursor.stack[:-1], i, prev_block)
+
+    def _delete_by_rowid(self, table_schema, rowid):
+        self._rightmost_cache.pop(table_schema.pgno, None)
+        path = self.pager.cursor(table_schema.pgno).descend(rowid)
+        table_leaf, cell_index = path[-1]
+        if cell_index == table_leaf.number_of_cells or table_leaf._rowid_at(
+            table_leaf.page.data, table_leaf._cell_pointer(cell_index)
+        ) != rowid:
             raise ValueError("rowid can't found:{}".format(rowid))
-        _, row = table_leaf.record(table_leaf_cell_index, table_schema.row_converter)
+        _, row = table_leaf.record(cell_index, table_schema.row_converter)
         # find related index and remove index
-        for index_schema in self.index_schemas(table_schema.table_name):
-            key = [row[c.name] for c in index_schema.columns]
-            index_ancestors, index_leaf, index_leaf_cell_index, found = self.pager.find_rowid_index_path(
-                index_schema.pgno, key, rowid, index_schema.orders, False
-            )
-            if found:
-                index_leaf.delete(index_leaf_cell_index)
+        for index_schema in self.index_schemas(table_schema.table_name) or []:
+            self._delete_index_record(index_schema, [row[c.name] for c in index_schema.columns], rowid)
         # remove record
-        table_leaf.delete(table_leaf_cell_index)
-        if table_ancestors:
-            table_ancestors[-1].merge_children()
+        table_leaf.delete(cell_index)
+        table_leaf.balance_after_delete(path[:-1])
 
     def delete_by_rowid(self, table_name, rowid):
         "delete table record by rowid"
@@ -282,11 +432,123 @@ class Database:
         # TODO: check constraint
         return self._delete_by_rowid(table_schema, rowid)
 
+    def _rows_in_rowid_range(self, table_schema, columns, min_rowid, max_rowid, limit):
+        "(rowid, row) list in the rowid range, or None if there are more than limit records"
+        positions, converter, _ = self._converter(table_schema, columns, "dict")
+        cursor = self.pager.cursor(table_schema.pgno)
+        valid = cursor.first() if min_rowid is None else cursor.seek(min_rowid)
+        rows = []
+        while valid and (max_rowid is None or cursor.rowid <= max_rowid):
+            if len(rows) == limit:
+                return None
+            rows.append(cursor.row(converter, positions))
+            valid = cursor.next()
+        return rows
+
+    def _delete_index_rowid_range(self, index_schema, min_rowid, max_rowid):
+        """rebuild index B-tree without records whose rowid is in the range.
+        New B-tree is built from a cursor on the old one, then moved to the root page.
+        """
+        def cell_blocks():
+            cursor = self.pager.cursor(index_schema.pgno)
+            valid = cursor.first()
+            while valid:
+                r = cursor.record()
+                if (min_rowid is not None and r[-1] < min_rowid) or (max_rowid is not None and r[-1] > max_rowid):
+                    yield new_root.to_cell_block(r[-1], r[:-1])
+                valid = cursor.next()
+
+        new_root = self.pager.new_page(BTREE_PAGE_TYPE_LEAF_INDEX).get_node()
+        build_btree(new_root, cell_blocks())
+        free_btree(self.pager, index_schema.pgno, keep_root=True)
+        # the root page number is kept, the empty old root is freed
+        swap_node(self.pager.get_page(index_schema.pgno).get_node(), new_root)
+        self.pager.add_to_freelist(self.pager.get_page(new_root.pgno))
+
+    def delete_range(self, table_name, min_rowid=None, max_rowid=None):
+        """delete table records whose rowid is between min_rowid and max_rowid (inclusive).
+        None means unbounded. Subtrees entirely in the range are freed at once.
+        If the range has fewer records than the database has pages, index records are deleted one by one,
+        otherwise indexes are rebuilt without the deleted records in one scan.
+        """
+        table_schema = self.table_schema(table_name)
+        if table_schema.without_rowid:
+            raise NotImplementedError("delete_range WITHOUT ROWID table")
+        self._rightmost_cache.pop(table_schema.pgno, None)
+        try:
+            index_schemas = self.index_schemas(table_name) or []
+            if index_schemas:
+                columns = []
+                for index_schema in index_schemas:
+                    columns.extend([c.name for c in index_schema.columns if c.name not in columns])
+                rows = self._rows_in_rowid_range(table_schema, columns, min_rowid, max_rowid, self.pager.max_pgno)
+                for index_schema in index_schemas:
+                    if rows is None:
+                        self._delete_index_rowid_range(index_schema, min_rowid, max_rowid)
+                        continue
+                    for rowid, row in rows:
+                        self._delete_index_record(index_schema, [row[c.name] for c in index_schema.columns], rowid)
+
+            root = self.pager.get_page(table_schema.pgno).get_node()
+            if root.delete_rowid_range(min_rowid, max_rowid):
+                root.page.initialize_page(BTREE_PAGE_TYPE_LEAF_TABLE)
+                root.page.get_node().rebuild([])
+                return
+            # nodes on both edges of the range may be underfull
+            for rowid in (min_rowid, max_rowid):
+                if rowid is None:
+                    continue
+                for depth in range(len(self.pager.cursor(table_schema.pgno).descend(rowid)), 0, -1):
+                    path = self.pager.cursor(table_schema.pgno).descend(rowid)
+                    if depth <= len(path):
+                        node, _ = path[depth - 1]
+                        node.balance_after_delete(path[:depth - 1])
+        except Exception:
+            self.rollback()
+            raise
+
+    def truncate(self, table_name):
+        "delete all records of the table and its indexes"
+        table_schema = self.table_schema(table_name)
+        self._rightmost_cache.pop(table_schema.pgno, None)
+        try:
+            free_btree(self.pager, table_schema.pgno, keep_root=True)
+            for index_schema in self.index_schemas(table_name) or []:
+                free_btree(self.pager, index_schema.pgno, keep_root=True)
+        except Exception:
+            self.rollback()
+            raise
+
+    def drop_table(self, table_name):
+        "drop the table with its indexes and triggers"
+        table_schema = self.table_schema(table_name)
+        if self.pager._read_header("largest_root_btree"):
+            raise NotImplementedError("drop_table in auto_vacuum database")
+        self._rightmost_cache.pop(table_schema.pgno, None)
+        try:
+            free_btree(self.pager, table_schema.pgno)
+            for index_schema in self.index_schemas(table_name) or []:
+                free_btree(self.pager, index_schema.pgno)
+
+            # remove schema records from sqlite_master
+            for rowid in [rowid for rowid, r in self.pager.records(1) if r[2] == table_name]:
+                path = self.pager.cursor(1).descend(rowid)
+                leaf, cell_index = path[-1]
+                leaf.delete(cell_index)
+                leaf.balance_after_delete(path[:-1])
+            self.pager.schema_cookie += 1
+        except Exception:
+            self.rollback()
+            raise
+
+        del self.tables[table_name]
+        self.indexes.pop(table_name, None)
+
     def update_by_rowid(self, table_name, rowid, update_dict):
         """update table record
         """
         table_schema = self.table_schema(table_name)
-        index_schemas = self.index_schemas(table_name)
+        index_schemas = self.index_schemas(table_name) or []
 
         # TODO: check constraint
         rowid_r = self._get_by_rowid(table_schema, rowid)
@@ -297,17 +559,45 @@ class Database:
 
     def commit(self):
         "Save cache page data to storage"
+        self._rightmost_cache = {}
         self.pager.flush()
 
     def rollback(self):
         "Rollback dirty pages"
+        self._rightmost_cache = {}
         self.pager.rollback()
 
+    def checkpoint(self):
+        "Copy committed pages in WAL file to database file"
+        self.pager.checkpoint()
+
+    def stats(self):
+        "Pager I/O and cache statistics. Call reset() of the result to clear counters"
+        return self.pager.stats
+
     def close(self):
         self.pager.close()
 
 
-def open(fileobj):
+def open(fileobj, cache_size=DEFAULT_CACHE_SIZE, mmap=False, journal_mode="delete", vfs=None, row_format="dict"):
+    """open database
+    cache_size is same as SQLite's PRAGMA cache_size.
+    positive value is number of pages, negative value is KiB.
+    If mmap is True, pages are read from memory mapped file (same as vfs="mmap").
+    journal_mode is "delete" (rollback journal), "off" or "wal".
+    WAL mode database is always opened as "wal".
+    vfs is storage backend "file", "mmap", "memory" or BaseVFS instance.
+    row_format is "dict", "tuple", "namedtuple" or "row". Values of "tuple" and "namedtuple" are in column order.
+    "row" returns Row which decodes a value on first access.
+    """
+    if row_format not in ROW_FORMATS:
+        raise ValueError("row_format={}".format(row_format))
+    name = None
     if isinstance(fileobj, str):
-        fileobj = builtins.open(fileobj, "rb+")
-    return Database(fileobj)
+        # file object may not have the name (MicroPython)
+        name = fileobj
+        fileobj = builtins.open(fileobj, "rb" if vfs == "memory" else "rb+")
+    return Database(
+        fileobj, cache_size=cache_size, mmap=mmap, journal_mode=journal_mode, vfs=vfs, row_format=row_format,
+        name=name
+    )
@@ -31,9 +31,14 @@ BTREE_PAGE_TYPE_INTERIOR_TABLE = 5
 BTREE_PAGE_TYPE_LEAF_INDEX = 10
 BTREE_PAGE_TYPE_LEAF_TABLE = 13
 
+# ratio of used bytes in pages built by build_btree()
+DEFAULT_FILL_FACTOR = 0.9
+
 
 __all__ = (
     "swap_node",
+    "build_btree",
+    "free_btree",
     "TableLeafCell",
     "TableInteriorCell",
     "IndexLeafCell",
@@ -52,21 +57,140 @@ def swap_node(node1, node2):
     page2 = node2.pager.get_page(node2.pgno)
     page1.data, page2.data = page2.data, page1.data
     page1.page_type, page2.page_type = page2.page_type, page1.page_type
+    page1.invalidate_node()
+    page2.invalidate_node()
+    page1.is_dirty = True
+    page2.is_dirty = True
     return page1.get_node(), page2.get_node()
 
 
+def _pack_nodes(blocks, dividers, capacity):
+    """group cells of one level into nodes.
+    blocks[i] is the cell (or child pointer) and dividers[i] goes up between node i and i+1.
+    return list of node cell list and list of dividers between the nodes
+    """
+    nodes, up = [], []
+    i = 0
+    while i < len(blocks):
+        cells, size = [blocks[i]], len(blocks[i]) + 2
+        while i + 1 < len(blocks) and size + len(blocks[i+1]) + 2 <= capacity:
+            i += 1
+            cells.append(blocks[i])
+            size += len(blocks[i]) + 2
+        if i == len(blocks) - 2 and len(cells) > 1:
+            # don't leave one cell for the last node
+            cells.pop()
+            i -= 1
+        nodes.append(cells)
+        if i < len(dividers):
+            up.append(dividers[i])
+        i += 1
+    return nodes, up
+
+
+def build_btree(root, cell_blocks, fill_factor=DEFAULT_FILL_FACTOR):
+    """build B-tree bottom-up on empty root leaf node.
+    cell_blocks is iterable of leaf cell blocks in key order.
+    Leaves and interior nodes are filled up to fill_factor of the page.
+    """
+    pager = root.pager
+    is_table = isinstance(root, TableLeafNode)
+    leaf_capacity = int((pager.page_size - 8) * fill_factor)
+
+    # leaf level: children is leaf pgno list, dividers is interior cells without left pointer
+    children, dividers = [], []
+    blocks, size = [], 0
+    prev_blocks = None
+    for cell_block in cell_blocks:
+        if not blocks or size + len(cell_block) + 2 <= leaf_capacity:
+            blocks.append(cell_block)
+            size += len(cell_block) + 2
+            continue
+        leaf = pager.new_page(root.page.page_type).get_node()
+        leaf.rebuild(blocks)
+        children.append(leaf.pgno)
+        if is_table:
+            dividers.append(to_varint(TableLeafNode._rowid_at(blocks[-1], 0)))
+            prev_blocks, blocks, size = blocks, [cell_block], len(cell_block) + 2
+        else:
+            # index cell moves up to the parent
+            dividers.append(cell_block)
+            prev_blocks, blocks, size = blocks, [], 0
+
+    if children and not blocks:
+        # index cells are ended with divider, take back last cell of previous leaf
+        leaf = pager.get_page(children[-1]).get_node()
+        if len(prev_blocks) > 1:
+            blocks = [dividers[-1]]
+            dividers[-1] = prev_blocks.pop()
+            leaf.rebuild(prev_blocks)
+        else:
+            leaf.rebuild(prev_blocks + [dividers.pop()])
+            children.pop()
+            blocks = leaf.cell_blocks()
+            pager.add_to_freelist(leaf.page)
+    if not children:
+        root.rebuild(blocks)
+        return
+    leaf = pager.new_page(root.page.page_type).get_node()
+    leaf.rebuild(blocks)
+    children.append(leaf.pgno)
+
+    # interior levels
+    interior_capacity = int((pager.page_size - 12) * fill_factor)
+    while True:
+        blocks = [pgno.to_bytes(4, "big") + d for pgno, d in zip(children, dividers)]
+        # the last child of a node is right_most
+        blocks.append(children[-1].to_bytes(4, "big"))
+        nodes, dividers = _pack_nodes(blocks, dividers, interior_capacity)
+        if len(nodes) == 1:
+            break
+        children = []
+        for cells in nodes:
+            node = pager.new_page(root.interior_page_type).get_node()
+            node.rebuild(cells[:-1], int.from_bytes(cells[-1][:4], 'big'))
+            children.append(node.pgno)
+    root.page.initialize_page(root.interior_page_type)
+    cells = nodes[0]
+    root.page.get_node().rebuild(cells[:-1], int.from_bytes(cells[-1][:4], 'big'))
+
+
+def free_btree(pager, pgno, keep_root=False):
+    """add all pages of the B-tree and their overflow pages to the freelist.
+    If keep_root is True, the root page is left as an empty leaf.
+    """
+    root = pager.get_page(pgno).get_node()
+    if isinstance(root, (TableLeafNode, TableInteriorNode)):
+        leaf_page_type = BTREE_PAGE_TYPE_LEAF_TABLE
+    else:
+        leaf_page_type = BTREE_PAGE_TYPE_LEAF_INDEX
+    pgnos = [pgno]
+    while pgnos:
+        node = pager.get_page(pgnos.pop()).get_node()
+        if isinstance(node, InteriorNodeMixIn):
+            pgnos.extend([node.child_pgno(i) for i in range(node.number_of_cells + 1)])
+        if not isinstance(node, TableInteriorNode):
+            for cell in node.cells:
+                cell.cell_payload.free_overflow_pages()
+        if node.pgno == pgno and keep_root:
+            node.page.initialize_page(leaf_page_type)
+            node.page.get_node().rebuild([])
+        else:
+            pager.add_to_freelist(node.page)
+
+
 class CellPayload:
-    def __init__(self, node, cell_pointer, payload_len, cell_content):
+    def __init__(self, node, cell_pointer, payload_len, data, offset):
+        "payload starts at offset of page data. first_payload is a memoryview slice of the page data"
         assert payload_len >= 0
         in_page_bytes = node.calculate_cell_in_page_bytes(payload_len)
         self.cell_size = in_page_bytes
+        first_payload = memoryview(data)[offset:offset+in_page_bytes]
         if in_page_bytes == payload_len:
-            first_payload = cell_content
             overflow_pgno = 0
         else:
-            assert len(cell_content) >= in_page_bytes+4
-            first_payload = cell_content[:in_page_bytes]
-            overflow_pgno = int.from_bytes(cell_content[in_page_bytes:in_page_bytes+4], 'big')
+            assert len(data) >= offset+in_page_bytes+4
+            overflow_pgno = int.from_bytes(data[offset+in_page_bytes:offset+in_page_bytes+4], 'big')
             self.cell_size += 4
         self.node = node
         self.cell_pointer = cell_pointer
@@ -74,16 +198,21 @@ class CellPayload:
         self.first_payload = first_payload
         self.overflow_pgno = overflow_pgno
 
-    def get_payload_with_overflow(self):
-        "get payload bytes with overflow"
-        buf = self.first_payload[:]
+    def get_payload_with_overflow(self, size=None):
+        """get payload bytes with overflow. payload in a page is not copied
+        If size is given, overflow pages are read until the payload has size bytes.
+        """
+        if not self.overflow_pgno or (size is not None and size <= len(self.first_payload)):
+            return self.first_payload
+        buf = bytearray(self.first_payload)
         overflow = self.overflow_pgno
-        while overflow:
+        while overflow and (size is None or len(buf) < size):
             page = self.node.pager.get_page(overflow)
+            self.node.pager.stats.count("overflow_pages", self.node.__class__.__name__)
             overflow = int.from_bytes(page.data[:4], 'big')
             buf += page.data[4:]
 
-        return buf[:self.payload_len]
+        return memoryview(buf)[:min(len(buf), self.payload_len)]
 
     def free_overflow_pages(self):
         "overflow page to free list"
@@ -108,9 +237,10 @@ class TableLeafCell(Cell):
     def __init__(self, node, cell_pointer):
         self.node = node
         self.cell_pointer = cell_pointer
-        payload_len, next_i = varint_and_next_index(node.page.data, cell_pointer)
-        self.rowid, next_i = varint_and_next_index(node.page.data, next_i)
-        self.cell_payload = CellPayload(node, cell_pointer, payload_len, node.page.data[next_i:])
+        data = node.page.data
+        payload_len, next_i = varint_and_next_index(data, cell_pointer)
+        self.rowid, next_i = varint_and_next_index(data, next_i)
+        self.cell_payload = CellPayload(node, cell_pointer, payload_len, data, next_i)
         self.size = (next_i - cell_pointer) + self.cell_payload.cell_size
 
     def _dump(self):
@@ -140,8 +270,9 @@ class IndexLeafCell(Cell):
     def __init__(self, node, cell_pointer):
         self.node = node
         self.cell_pointer = cell_pointer
-        payload_len, next_i = varint_and_next_index(node.page.data, cell_pointer)
-        self.cell_payload = CellPayload(node, cell_pointer, payload_len, node.page.data[next_i:])
+        data = node.page.data
+        payload_len, next_i = varint_and_next_index(data, cell_pointer)
+        self.cell_payload = CellPayload(node, cell_pointer, payload_len, data, next_i)
         self.size = (next_i - cell_pointer) + self.cell_payload.cell_size
 
 
@@ -149,12 +280,56 @@ class IndexInteriorCell(Cell):
     def __init__(self, node, cell_pointer):
         self.node = node
         self.cell_pointer = cell_pointer
-        self.left_page = int.from_bytes(node.page.data[cell_pointer:cell_pointer + 4], 'big')
-        payload_len, next_i = varint_and_next_index(node.page.data, cell_pointer + 4)
-        self.cell_payload = CellPayload(node, cell_pointer, payload_len, node.page.data[next_i:])
+        data = node.page.data
+        self.left_page = int.from_bytes(data[cell_pointer:cell_pointer + 4], 'big')
+        payload_len, next_i = varint_and_next_index(data, cell_pointer + 4)
+        self.cell_payload = CellPayload(node, cell_pointer, payload_len, data, next_i)
         self.size = (next_i - cell_pointer) + self.cell_payload.cell_size
 
 
+class CellList:
+    """cells of a node decoded on demand from the cell pointer array.
+    decoded cells are kept in a memo by cell pointer.
+    """
+    def __init__(self, node, cell_class):
+        self.node = node
+        self.cell_class = cell_class
+        self._cell_pointers = None
+        self._memo = {}
+
+    @property
+    def cell_pointers(self):
+        if self._cell_pointers is None:
+            self._cell_pointers = self.node.read_cell_pointers()
+        return self._cell_pointers
+
+    def _get_cell(self, cell_pointer):
+        cell = self._memo.get(cell_pointer)
+        if cell is None:
+            cell = self.cell_class(self.node, cell_pointer)
+            self._memo[cell_pointer] = cell
+        return cell
+
+    def __len__(self):
+        return len(self.cell_pointers)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._get_cell(c) for c in self.cell_pointers[i]]
+        return self._get_cell(self.cell_pointers[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def pop(self, i=-1):
+        cell_pointer = self.cell_pointers.pop(i)
+        cell = self._memo.pop(cell_pointer, None)
+        if cell is None:
+            cell = self.cell_class(self.node, cell_pointer)
+        return cell
+
+
 class BTreeNode:
     def __init__(self, page):
         self.pgno = page.pgno
@@ -212,18 +387,6 @@ class BTreeNode:
         current_free_block_size = int.from_bytes(self.page.data[cell_offset+2:cell_offset+4], 'big')
         return next_free_block_offset, current_free_block_size
 
-    def _merge_free_block(self, cell_offset):
-        next_offset, size = self._next_free_block_offset_and_current_free_block_size(cell_offset)
-        if cell_offset + size == next_offset:
-            next_next_offset, next_size = self._next_free_block_offset_and_current_free_block_size(next_offset)
-            self._write_page(next_next_offset.to_bytes(2, "big"), cell_offset)
-            self._write_page((size+next_size).to_bytes(2, "big"), cell_offset+2)
-            self._write_page(b'\x00\x00', next_offset)
-            self._write_page(b'\x00\x00', next_offset+2)
-
-            return True
-        return False
-
     def _write_page(self, data, offset):
         self.pager.get_page(self.pgno).write(data, offset)
 
@@ -290,77 +453,102 @@ class BTreeNode:
         next_page = self.pager.new_page(BTREE_PAGE_TYPE_RAW_PAGE)
         first_next_pgno = next_page.pgno
         p = trailing_pages.pop(0)
-        next_page.data[4:len(p)+4] = p
+        next_page.write(p, 4)
         while trailing_pages:
             next_next_page = self.pager.new_page(BTREE_PAGE_TYPE_RAW_PAGE)
-            next_page.data[0:4] = next_next_page.pgno.to_bytes(4, "big")
+            next_page.write(next_next_page.pgno.to_bytes(4, "big"), 0)
             p = trailing_pages.pop(0)
-            next_next_page.data[4:len(p)+4] = p
+            next_next_page.write(p, 4)
             next_page = next_next_page
 
         return first_payload + first_next_pgno.to_bytes(4, "big")
 
-    def sweep(self):
-        "sweep cell blocks"
-        cell_blocks = bytearray()
-        cell_pointers = []
-        first_byte_of_cell_content = self.page.pager.page_size
-        for cell in self.cells:
-            cell_blocks = cell.cell_block[:] + cell_blocks[:]
-            first_byte_of_cell_content -= len(cell.cell_block)
-            cell_pointers.append(first_byte_of_cell_content)
-
-        self.free_block_offset = 0
-        self.page.data[self.first_cell_offset:self.page.pager.page_size] = (
-            b'\x00' * (self.page.pager.page_size - self.first_cell_offset)
-        )
-        self.page.data[first_byte_of_cell_content:self.page.pager.page_size] = cell_blocks
-        self.write_cell_pointers(cell_pointers)
-
-        self._update_cells()
-
     def find_cell_pointer_from_free_block(self, cell_block_size):
         """find cell_pointer from free_block
         Returns None if there is not enough free_block
         """
-        if self.free_block_offset:
-            free_block_offset = self.free_block_offset
-            while free_block_offset:
-                next_offset, size = self._next_free_block_offset_and_current_free_block_size(free_block_offset)
-                if size == cell_block_size:
-                    if self.free_block_offset == free_block_offset:
-                        self.free_block_offset = next_offset
-                        return free_block_offset
-                free_block_offset = next_offset
+        free_blocks = self._free_blocks()
+        for i, (offset, size) in enumerate(free_blocks):
+            if size == cell_block_size:
+                free_blocks.pop(i)
+                self._write_free_blocks(free_blocks)
+                return offset
         return None
 
-    def merge_free_block(self):
-        """if free cell blocks are contiguous, merge them.
-        """
+    def _free_blocks(self):
+        "list of (offset, size) of free blocks"
+        free_blocks = []
         free_block_offset = self.free_block_offset
         while free_block_offset:
-            if self._merge_free_block(free_block_offset):
-                free_block_offset = self.free_block_offset
+            next_offset, size = self._next_free_block_offset_and_current_free_block_size(free_block_offset)
+            free_blocks.append((free_block_offset, size))
+            free_block_offset = next_offset
+        return free_blocks
+
+    def _write_free_blocks(self, free_blocks):
+        """write free block list sorted by offset same as SQLite freeSpace().
+        contiguous blocks are merged, and blocks at the start of the cell content area are
+        returned to the unallocated space.
+        """
+        free_blocks.sort()
+        merged = []
+        fragmented = self.number_of_fragmented_free_bytes
+        for offset, size in free_blocks:
+            if merged and offset - (merged[-1][0] + merged[-1][1]) <= 3:
+                # absorb fragmented bytes between blocks
+                gap = offset - (merged[-1][0] + merged[-1][1])
+                fragmented -= min(gap, fragmented)
+                merged[-1] = (merged[-1][0], offset + size - merged[-1][0])
             else:
-                next_offset, size = self._next_free_block_offset_and_current_free_block_size(free_block_offset)
-                free_block_offset = next_offset
-
-        # clear free_block_offset
-        next_offset, size = self._next_free_block_offset_and_current_free_block_size(self.free_block_offset)
-        if self.free_block_offset + size == self.first_byte_of_cell_content:
-            self.free_block_offset = next_offset
+                merged.append((offset, size))
+
+        first_byte_of_cell_content = self.first_byte_of_cell_content or 65536
+        while merged and merged[0][0] <= first_byte_of_cell_content:
+            offset, size = merged.pop(0)
+            first_byte_of_cell_content = offset + size
+
+        for i, (offset, size) in enumerate(merged):
+            next_offset = merged[i+1][0] if i + 1 < len(merged) else 0
+            self._write_page(next_offset.to_bytes(2, "big") + size.to_bytes(2, "big"), offset)
+        self.free_block_offset = merged[0][0] if merged else 0
+        self.first_byte_of_cell_content = first_byte_of_cell_content % 65536
+        self.number_of_fragmented_free_bytes = fragmented
+
+    def _cell_pointer(self, cell_index):
+        i = self.first_cell_offset + cell_index * 2
+        return int.from_bytes(self.page.data[i:i+2], 'big')
+
+    def _bisect_left(self, key_at, key):
+        """binary search over cell pointer array.
+        key_at(data, cell_pointer) returns the key of the cell.
+        return the first cell index whose key >= key
+        """
+        data = self.page.data
+        first_cell_offset = self.first_cell_offset
+        lo, hi = 0, self.number_of_cells
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = first_cell_offset + mid * 2
+            if key_at(data, int.from_bytes(data[i:i+2], 'big')) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
 
     def read_cell_pointers(self):
+        data = self.page.data
+        first_cell_offset = self.first_cell_offset
         return [
-            int.from_bytes(self.page.data[i:i+2], 'big')
-            for i in range(self.first_cell_offset, self.first_cell_offset+self.number_of_cells*2, 2)
+            int.from_bytes(data[i:i+2], 'big')
+            for i in range(first_cell_offset, first_cell_offset+self.number_of_cells*2, 2)
         ]
 
     def write_cell_pointers(self, pointers):
-        for i, p in enumerate(pointers):
-            self._write_page(p.to_bytes(2, "big"), self.first_cell_offset + i * 2)
+        buf = bytearray()
+        for p in pointers:
+            buf += p.to_bytes(2, "big")
+        self._write_page(buf, self.first_cell_offset)
         self.number_of_cells = len(pointers)
-        self._write_page(self.number_of_cells.to_bytes(2, "big"), 3)
 
     def free_cell_size(self):
         cell_pointers = self.read_cell_pointers()
@@ -368,7 +556,7 @@ class BTreeNode:
             min_cell_pointer = self.page.pager.page_size
         else:
             min_cell_pointer = min(cell_pointers)
-        return min_cell_pointer - (self.first_cell_offset + (self.number_of_cells + 1) * 2)
+        return min_cell_pointer - (self.first_cell_offset + (len(cell_pointers) + 1) * 2)
 
     def get_free_cell_size(self):
         cell_pointers = self.read_cell_pointers()
@@ -377,6 +565,196 @@ class BTreeNode:
     def _update_cells(self):
         raise NotImplementedError()
 
+    def cell_blocks(self):
+        "copy of all cell blocks in cell order"
+        return [bytes(cell.cell_block) for cell in self.cells]
+
+    def rebuild(self, cell_blocks, right_most=None):
+        "rewrite the page with cell_blocks packed at the end of the page"
+        page = self.page
+        page.initialize_page(page.page_type)
+        content = b''.join(reversed(cell_blocks))
+        first_byte_of_cell_content = self.pager.page_size - len(content)
+        pointers = bytearray()
+        cell_pointer = self.pager.page_size
+        for cell_block in cell_blocks:
+            cell_pointer -= len(cell_block)
+            pointers += cell_pointer.to_bytes(2, "big")
+        page.write(pointers, self.first_cell_offset)
+        page.write(content, first_byte_of_cell_content)
+        self.number_of_cells = len(cell_blocks)
+        self.first_byte_of_cell_content = first_byte_of_cell_content % 65536
+        if right_most is not None:
+            self.right_most = right_most
+        self._update_cells()
+
+    def _split_position(self, cell_blocks):
+        "index of the cell where the bytes of cell_blocks are divided in half"
+        total = sum([len(b) + 2 for b in cell_blocks])
+        amount = 0
+        for i, cell_block in enumerate(cell_blocks):
+            amount += len(cell_block) + 2
+            if amount * 2 > total:
+                break
+        return max(1, min(i, len(cell_blocks) - 2))
+
+    def _split_positions(self, cell_blocks, append=False):
+        "indexes of the cells where cell_blocks are divided into nodes"
+        return [self._split_position(cell_blocks)]
+
+    def _split_cell_blocks(self, cell_blocks, i):
+        """divide cell_blocks at i
+        return (left cell_blocks, left right_most, divider, right cell_blocks)
+        divider is the parent interior cell without left child pointer.
+        """
+        raise NotImplementedError()
+
+    def _split_groups(self, cell_blocks, right_most, append):
+        """divide cell_blocks into nodes.
+        return list of (cell_blocks, right_most) of the nodes and list of dividers between them
+        """
+        groups, dividers = [], []
+        rest = cell_blocks
+        done = 0
+        for i in self._split_positions(cell_blocks, append):
+            left_blocks, left_right_most, divider, rest = self._split_cell_blocks(rest, i - done)
+            done = len(cell_blocks) - len(rest)
+            groups.append((left_blocks, left_right_most))
+            dividers.append(divider)
+        groups.append((rest, right_most))
+        return groups, dividers
+
+    def _new_node(self, cell_blocks, right_most):
+        "new page of same type with cell_blocks and return the page number"
+        node = self.pager.new_page(self.page.page_type).get_node()
+        node.rebuild(cell_blocks, right_most)
+        return node.pgno
+
+    def insert_and_balance(self, path, cell_index, cell_block):
+        """insert cell_block at cell_index.
+        If the node overflows, split it and insert the divider cells to the parent recursively.
+        path is list of [interior node, child index] from the root to this node.
+        """
+        node = self
+        path = list(path)
+        # appending to the rightmost table leaf
+        append = isinstance(node, TableLeafNode) and cell_index == node.number_of_cells and all(
+            [i == n.number_of_cells for n, i in path]
+        )
+        new_blocks = [cell_block]
+        while node.free_cell_size() < sum([len(b) + 2 for b in new_blocks]) - 2:
+            cell_blocks = node.cell_blocks()
+            cell_blocks[cell_index:cell_index] = new_blocks
+            right_most = node.right_most if isinstance(node, InteriorNodeMixIn) else None
+            groups, dividers = node._split_groups(cell_blocks, right_most, append)
+            if not path:
+                # keep root page number
+                pgnos = [node._new_node(blocks, rm) for blocks, rm in groups]
+                node.page.initialize_page(node.interior_page_type)
+                root = node.page.get_node()
+                root.rebuild([pgno.to_bytes(4, "big") + d for pgno, d in zip(pgnos, dividers)], pgnos[-1])
+                return
+            if append:
+                # quick balance: new right node takes over the right_most pointer of the parent
+                pgnos = [node.pgno] + [node._new_node(blocks, rm) for blocks, rm in groups[1:]]
+                node.rebuild(*groups[0])
+            else:
+                pgnos = [node._new_node(blocks, rm) for blocks, rm in groups[:-1]] + [node.pgno]
+                node.rebuild(*groups[-1])
+            node, cell_index = path.pop()
+            if append:
+                node.right_most = pgnos[-1]
+                append = False
+            new_blocks = [pgno.to_bytes(4, "big") + d for pgno, d in zip(pgnos, dividers)]
+        for i, b in enumerate(new_blocks):
+            node.insert_cell_block(cell_index + i, b)
+
+    def used_size(self):
+        "bytes used by cells and cell pointers"
+        return sum([cell.size + 2 for cell in self.cells])
+
+    def _fits(self, cell_blocks):
+        "cell_blocks fit in a new page of this node type"
+        capacity = self.pager.page_size - (self.first_cell_offset - self.page_offset)
+        return sum([len(b) + 2 for b in cell_blocks]) <= capacity
+
+    def _balance_position(self, cell_blocks):
+        """split position of cell_blocks of two siblings.
+        Left node is packed, then cells are moved to right node while it is not larger than left node
+        same as SQLite.
+        """
+        # table leaf doesn't use a cell as divider
+        k = 0 if isinstance(self, TableLeafNode) else 1
+        capacity = self.pager.page_size - (self.first_cell_offset - self.page_offset)
+        sizes = [len(b) + 2 for b in cell_blocks]
+        i, left = 0, 0
+        while i < len(sizes) - 1 - k and left + sizes[i] <= capacity:
+            left += sizes[i]
+            i += 1
+        right = sum(sizes[i+k:])
+        while i > 1:
+            # last cell of left (or the divider) moves to right
+            new_left = left - sizes[i-1]
+            new_right = right + sizes[i-1+k]
+            if new_right > new_left or new_right > capacity:
+                break
+            left, right = new_left, new_right
+            i -= 1
+        return i
+
+    def balance_after_delete(self, path):
+        """merge or redistribute the underfull node with its sibling and update the divider in the parent.
+        Nodes less than 1/3 used are balanced up to the root same as SQLite.
+        path is list of [interior node, child index] from the root to this node.
+        """
+        node = self
+        path = list(path)
+        while path and node.used_size() * 3 < node.pager.page_size:
+            parent, i = path.pop()
+            # divider index between left and right
+            d = i - 1 if i > 0 else 0
+            if parent.number_of_cells == 0:
+                # no sibling, balance the parent which has only this child
+                node = parent
+                continue
+            left = node.pager.get_page(parent.child_pgno(d)).get_node()
+            right = node.pager.get_page(parent.child_pgno(d + 1)).get_node()
+            parent_blocks = parent.cell_blocks()
+            cell_blocks, right_most = left._join_cell_blocks(right, parent_blocks[d][4:])
+            del parent_blocks[d]
+            if left._fits(cell_blocks):
+                # merge into right node which is pointed from the next parent cell
+                right.rebuild(cell_blocks, right_most)
+                node.pager.add_to_freelist(left.page)
+                parent.rebuild(parent_blocks, parent.right_most)
+                node = parent
+                continue
+            left_blocks, left_right_most, divider, right_blocks = left._split_cell_blocks(
+                cell_blocks, left._balance_position(cell_blocks)
+            )
+            if len(left_blocks) == left.number_of_cells:
+                # no cell to move
+                return
+            left.rebuild(left_blocks, left_right_most)
+            right.rebuild(right_blocks, right_most)
+            parent.rebuild(parent_blocks, parent.right_most)
+            # new divider may be larger than old one
+            parent.insert_and_balance(path, d, left.pgno.to_bytes(4, "big") + divider)
+            return
+
+        while not path and isinstance(node, InteriorNodeMixIn) and node.number_of_cells == 0:
+            # root has only one child, move it to the root
+            child = node.pager.get_page(node.right_most).get_node()
+            cell_blocks = child.cell_blocks()
+            capacity = node.pager.page_size - node.page_offset - (child.first_cell_offset - child.page_offset)
+            if sum([len(b) + 2 for b in cell_blocks]) > capacity:
+                break
+            right_most = child.right_most if isinstance(child, InteriorNodeMixIn) else None
+            node.page.initialize_page(child.page.page_type)
+            node = node.page.get_node()
+            node.rebuild(cell_blocks, right_most)
+            node.pager.add_to_freelist(child.page)
+
     def insert_cell_block(self, cell_index, cell_block):
         assert self.free_cell_size() >= len(cell_block)
 
@@ -388,15 +766,11 @@ class BTreeNode:
             if cell_pointer is None:
                 cell_pointer = min(cell_pointers) - len(cell_block)
         self._write_page(cell_block, cell_pointer)
-        cell_pointers = self.read_cell_pointers()
         cell_pointers.insert(cell_index, cell_pointer)
         self.write_cell_pointers(cell_pointers)
         self.first_byte_of_cell_content = min(cell_pointers)
         self._update_cells()
 
-    def append_cell_block(self, cell_block):
-        return self.insert_cell_block(self.number_of_cells, cell_block)
-
     def calculate_cell_in_page_bytes(self, payload_len):
         u = self.pager.page_size
         p = payload_len
@@ -418,29 +792,11 @@ class BTreeNode:
         cell.cell_payload.free_overflow_pages()
         # fill cell with zeros
         self._write_page(b'\x00' * cell.size, cell.cell_pointer)
-        # free block size
-        self._write_page(cell.size.to_bytes(2, "big"), cell.cell_pointer+2)
-
-        # recalc free_block_offset and first_byte_of_cell_content
-        if len(self.cells) == 0:
-            self.free_block_offset = 0
-            self.first_byte_of_cell_content = self.page.pager.page_size
-        else:
-            if self.free_block_offset == 0:
-                self.free_block_offset = cell.cell_pointer
-            else:
-                self._write_page(self.free_block_offset.to_bytes(2, "big"), cell.cell_pointer)
-                self.free_block_offset = cell.cell_pointer
-            self.first_byte_of_cell_content = min([c.cell_pointer for c in self.cells])
 
         # save remaining pointers
         self.write_cell_pointers([c.cell_pointer for c in self.cells])
 
-        self.merge_free_block()
-
-    def append_cell_from(self, from_node, cell):
-        assert type(self) == type(from_node)
-        self.append_cell_block(cell.cell_block)
+        self._write_free_blocks(self._free_blocks() + [(cell.cell_pointer, cell.size)])
 
 
 class LeafNodeMixIn:
@@ -454,10 +810,58 @@ class InteriorNodeMixIn:
     def first_cell_offset(self):
         return self.page_offset + 12
 
+    def child_pgno(self, i):
+        "page number of i th child. number_of_cells means right_most"
+        if i < self.number_of_cells:
+            cell_pointer = self._cell_pointer(i)
+            return int.from_bytes(self.page.data[cell_pointer:cell_pointer+4], 'big')
+        return self.right_most
+
+    def _join_cell_blocks(self, right, divider):
+        """cell_blocks of this node, divider and right sibling node
+        return (cell_blocks, right_most)
+        """
+        # right_most of this node gets the divider
+        return (
+            self.cell_blocks() + [self.right_most.to_bytes(4, "big") + divider] + right.cell_blocks(),
+            right.right_most
+        )
+
 
 class TableLeafNode(BTreeNode, LeafNodeMixIn):
+    interior_page_type = BTREE_PAGE_TYPE_INTERIOR_TABLE
+
     def _update_cells(self):
-        self.cells = [TableLeafCell(self, c) for c in self.read_cell_pointers()]
+        self.cells = CellList(self, TableLeafCell)
+
+    def _split_positions(self, cell_blocks, append=False):
+        if append:
+            # quick balance: only the appended cell goes to the new right node
+            return [len(cell_blocks) - 1]
+        i = self._split_position(cell_blocks)
+        capacity = self.pager.page_size - 8
+        if (
+            sum([len(b) + 2 for b in cell_blocks[:i]]) <= capacity and
+            sum([len(b) + 2 for b in cell_blocks[i:]]) <= capacity
+        ):
+            return [i]
+        # large cells can't be divided into two nodes
+        positions, size = [], 0
+        for i, cell_block in enumerate(cell_blocks):
+            if size + len(cell_block) + 2 > capacity:
+                positions.append(i)
+                size = 0
+            size += len(cell_block) + 2
+        return positions
+
+    def _split_cell_blocks(self, cell_blocks, i):
+        # divider is the largest rowid of the left node
+        rowid = self._rowid_at(cell_blocks[i - 1], 0)
+        return cell_blocks[:i], None, to_varint(rowid), cell_blocks[i:]
+
+    def _join_cell_blocks(self, right, divider):
+        # divider is not a record of table
+        return self.cell_blocks() + right.cell_blocks(), None
 
     def __init__(self, page):
         super().__init__(page)
@@ -494,24 +898,6 @@ class TableLeafNode(BTreeNode, LeafNodeMixIn):
         payload = pack_value_list(value_list)
         return to_varint(len(payload)), to_varint(rowid), payload
 
-    def split_by_index(self, cell_index):
-        assert self.number_of_cells >= cell_index
-
-        # create new empty node
-        new_page = self.page.pager.new_page()
-        new_page.initialize_page(self.page.page_type)
-        new_node = new_page.get_node()
-
-        # copy right cells to new_node
-        for i in range(cell_index, self.number_of_cells):
-            new_node.append_cell_from(self, self.cells[i])
-
-        # delete rite cells
-        while len(self.cells) > cell_index:
-            self.delete(len(self.cells) - 1)
-
-        return new_node
-
     def to_cell_block(self, rowid, value_list):
         ln, rowid, payload = self._pack_record(rowid, value_list)
         r = ln + rowid + payload
@@ -523,13 +909,13 @@ class TableLeafNode(BTreeNode, LeafNodeMixIn):
         r = ln + rowid + payload
         return r
 
+    @staticmethod
+    def _rowid_at(data, cell_pointer):
+        _, next_i = varint_and_next_index(data, cell_pointer)
+        return varint_and_next_index(data, next_i)[0]
+
     def find_cell_index(self, rowid):
-        cell_index = 0
-        for i, cell in enumerate(self.cells):
-            if cell.rowid >= rowid:
-                break
-            cell_index = i + 1
-        return cell_index
+        return self._bisect_left(self._rowid_at, rowid)
 
     def insert(self, rowid, cell_index, cell_block):
         self.insert_cell_block(cell_index, cell_block)
@@ -538,38 +924,44 @@ class TableLeafNode(BTreeNode, LeafNodeMixIn):
         return self.pager.page_size - 35
 
     def find_rowid_table_path(self, rowid, ancestors):
-        for i, cell in enumerate(self.cells):
-            if rowid > cell.rowid:
-                continue
-            elif rowid > cell.rowid:
-                break
-            return ancestors, self, i, rowid == cell.rowid
-        return ancestors, self, len(self.cells), False
-
-    def rowid_range_records(self, min_rowid, max_rowid, converter):
-        for cell in self.cells:
-            if min_rowid > cell.rowid:
-                continue
-            elif max_rowid > cell.rowid:
-                break
-            yield converter(cell.rowid, decode_payload(cell.cell_payload.get_payload_with_overflow()))
-
-    def records(self, converter):
-        for cell in self.cells:
-            yield converter(cell.rowid, decode_payload(cell.cell_payload.get_payload_with_overflow()))
+        i = self.find_cell_index(rowid)
+        if i < self.number_of_cells:
+            return ancestors, self, i, rowid == self._rowid_at(self.page.data, self._cell_pointer(i))
+        return ancestors, self, i, False
 
     def record(self, cell_index, converter):
         cell = self.cells[cell_index]
         return converter(cell.rowid, decode_payload(cell.cell_payload.get_payload_with_overflow()))
 
+    def delete_rowid_range(self, min_rowid, max_rowid, lower=None, upper=None):
+        """delete cells whose rowid is between min_rowid and max_rowid. None means unbounded.
+        return True if the node becomes empty
+        """
+        cell_blocks = []
+        for cell in self.cells:
+            if (min_rowid is None or min_rowid <= cell.rowid) and (max_rowid is None or cell.rowid <= max_rowid):
+                cell.cell_payload.free_overflow_pages()
+            else:
+                cell_blocks.append(bytes(cell.cell_block))
+        if len(cell_blocks) < self.number_of_cells:
+            self.rebuild(cell_blocks)
+        return not cell_blocks
+
 
 class TableInteriorNode(BTreeNode, InteriorNodeMixIn):
+    interior_page_type = BTREE_PAGE_TYPE_INTERIOR_TABLE
+
     @classmethod
     def new_node(cls, pager):
         return pager.new_page(BTREE_PAGE_TYPE_INTERIOR_TABLE).get_node()
 
     def _update_cells(self):
-        self.cells = [TableInteriorCell(self, c) for c in self.read_cell_pointers()]
+        self.cells = CellList(self, TableInteriorCell)
+
+    def _split_cell_blocks(self, cell_blocks, i):
+        # left child of the divider becomes right_most of the left node
+        divider = cell_blocks[i]
+        return cell_blocks[:i], int.from_bytes(divider[:4], 'big'), divider[4:], cell_blocks[i+1:]
 
     def __init__(self, page):
         super().__init__(page)
@@ -581,117 +973,78 @@ class TableInteriorNode(BTreeNode, InteriorNodeMixIn):
         for cell in self.cells:
             print("\tleft={},key={},size={}".format(cell.left_page, cell.key, cell.size))
 
-    def _pack_record(self, left_pgno, key):
-        return left_pgno.to_bytes(4, "big") + to_varint(key)
-
     def max_in_page_payload(self):
         raise NotImplementedError()
 
-    def split_by_index(self, cell_index):
-        assert self.number_of_cells >= cell_index
-
-        # create new empty node
-        new_page = self.page.pager.new_page()
-        new_page.initialize_page(self.page.page_type)
-        new_node = new_page.get_node()
-
-        # copy right cells to new_node
-        for i in range(cell_index, self.number_of_cells):
-            new_node.append_cell_from(self, self.cells[i])
+    @staticmethod
+    def _key_at(data, cell_pointer):
+        return varint_and_next_index(data, cell_pointer + 4)[0]
 
-        # delete rite cells
-        while len(self.cells) > cell_index:
-            self.delete(len(self.cells) - 1)
-
-        new_node.right_most = self.right_most
-        self.right_most = new_node.pgno
-        self.sweep()
-
-        return new_node
-
-    def insert_node_index(self, leaf_node, cell_index):
-        cell_block = self._pack_record(leaf_node.page.pgno, leaf_node.cells[-1].rowid)
-        if self.free_cell_size() < len(cell_block):
-            new_node = self.split_by_index(cell_index)
-            if self.free_cell_size() < len(cell_block):
-                new_node.append_cell_block(cell_block)
-            else:
-                self.append_cell_block(cell_block)
+    def find_rowid_table_path(self, rowid, ancestors):
+        i = self._bisect_left(self._key_at, rowid)
+        if i < self.number_of_cells:
+            cell_pointer = self._cell_pointer(i)
+            pgno = int.from_bytes(self.page.data[cell_pointer:cell_pointer+4], 'big')
         else:
-            self.insert_cell_block(cell_index, cell_block)
-
-    def insert_node_after(self, leaf_node, ancestors, prev_leaf_node):
-        """insert TaleLeafNode page leaf_node befre prev_leaf_node
+            pgno = self.right_most
+        ancestors.append(self)
+        node = self.page.pager.get_page(pgno).get_node()
+        return node.find_rowid_table_path(rowid, ancestors)
+
+    def delete_rowid_range(self, min_rowid, max_rowid, lower=None, upper=None):
+        """delete records whose rowid is between min_rowid and max_rowid. None means unbounded.
+        lower (exclusive) and upper (inclusive) are rowid bounds of this node.
+        Children entirely in the range are freed without reading their records.
+        return True if the node becomes empty
         """
-        assert self.right_most == prev_leaf_node.page.pgno
-        self.right_most = leaf_node.page.pgno
-        self.insert_node_index(prev_leaf_node, len(self.cells))
-
-    def find_rowid_table_path(self, rowid, ancestors):
-        for cell in self.cells:
-            if rowid > cell.key:
-                continue
-            if rowid > cell.key:
-                break
-            ancestors.append(self)
-            node = self.page.pager.get_page(cell.left_page).get_node()
-            return node.find_rowid_table_path(rowid, ancestors)
-        if rowid > self.cells[-1].key:
-            ancestors.append(self)
-            node = self.page.pager.get_page(self.right_most).get_node()
-            return node.find_rowid_table_path(rowid, ancestors)
-        raise ValueError("Unexpected node:{}".format(self.page.pgno))
-
-    def rowid_range_records(self, min_rowid, max_rowid, converter):
-        for cell in self.cells:
-            if min_rowid > cell.key:
-                continue
-            if max_rowid > cell.key:
-                break
-            node = self.page.pager.get_page(cell.left_page).get_node()
-            for r in node.rowid_range_records(min_rowid, max_rowid, converter):
-                yield r
-        if max_rowid > self.cells[-1].key:
-            node = self.page.pager.get_page(self.right_most).get_node()
-            for r in node.rowid_range_records(min_rowid, max_rowid, converter):
-                yield r
-
-    def records(self, converter):
-        for cell in self.cells:
-            node = self.page.pager.get_page(cell.left_page).get_node()
-            for r in node.records(converter):
-                yield r
-        node = self.page.pager.get_page(self.right_most).get_node()
-        for r in node.records(converter):
-            yield r
-
-    def merge_children(self):
-        page = self.pager.get_page(self.pgno)
-        children = [self.pager.get_page(c.left_page).get_node() for c in self.cells]
-        if self.right_most:
-            children.append(self.pager.get_page(self.right_most).get_node())
-        amount_of_page_size = self.page_offset + 8
-        for child in children:
-            amount_of_page_size += (child.number_of_cells * 2) + sum([c.size for c in child.cells])
-        if amount_of_page_size > self.page.pager.page_size:
-            return
-
-        # merge children and remove TableInteriorNode
-        page.initialize_page(BTREE_PAGE_TYPE_LEAF_TABLE)
-        table_leaf_node = page.get_node()
-        for child in children:
-            for cell in child.cells:
-                table_leaf_node.append_cell_from(child, cell)
-            self.pager.add_to_freelist(child.page)
+        children = []
+        for i in range(self.number_of_cells + 1):
+            pgno = self.child_pgno(i)
+            if i < self.number_of_cells:
+                child_upper = self._key_at(self.page.data, self._cell_pointer(i))
+            else:
+                child_upper = upper
+            if (
+                (min_rowid is None or (lower is not None and min_rowid <= lower + 1)) and
+                (max_rowid is None or (child_upper is not None and child_upper <= max_rowid))
+            ):
+                free_btree(self.pager, pgno)
+            elif (
+                (max_rowid is not None and lower is not None and max_rowid <= lower) or
+                (min_rowid is not None and child_upper is not None and child_upper < min_rowid)
+            ):
+                children.append((pgno, child_upper))
+            else:
+                child = self.pager.get_page(pgno).get_node()
+                if child.delete_rowid_range(min_rowid, max_rowid, lower, child_upper):
+                    self.pager.add_to_freelist(child.page)
+                else:
+                    children.append((pgno, child_upper))
+            lower = child_upper
 
-    def delete(self, cell_index):
-        raise NotImplementedError()
+        if not children:
+            return True
+        if len(children) < self.number_of_cells + 1:
+            self.rebuild(
+                [pgno.to_bytes(4, "big") + to_varint(key) for pgno, key in children[:-1]],
+                children[-1][0]
+            )
+        return False
 
 
 class IndexLeafNode(BTreeNode, LeafNodeMixIn):
+    interior_page_type = BTREE_PAGE_TYPE_INTERIOR_INDEX
+
     def _update_cells(self):
-        self.cells = [self._parse_index_leaf(c) for c in self.read_cell_pointers()]
-        self.cells = [IndexLeafCell(self, c) for c in self.read_cell_pointers()]
+        self.cells = CellList(self, IndexLeafCell)
+
+    def _split_cell_blocks(self, cell_blocks, i):
+        # the median cell moves up to the parent
+        return cell_blocks[:i], None, cell_blocks[i], cell_blocks[i+1:]
+
+    def _join_cell_blocks(self, right, divider):
+        # the divider cell moves down from the parent
+        return self.cell_blocks() + [divider] + right.cell_blocks(), None
 
     def __init__(self, page):
         super().__init__(page)
@@ -716,53 +1069,16 @@ class IndexLeafNode(BTreeNode, LeafNodeMixIn):
         for cell in self.cells:
             print("    {}".format(decode_payload(cell.cell_payload.get_payload_with_overflow())))
 
-    def _pack_record(self, key, rowid):
-        r = pack_value_list(key + [rowid])
-        return to_varint(len(r)) + r
-
-    def split_by_median(self):
-        assert self.number_of_cells >= 3
-        cell_index = self.number_of_cells - self.number_of_cells // 2
-        cell_block = self.cells[cell_index].cell_block
-
-        # create new empty node
-        new_page = self.page.pager.new_page()
-        new_page.initialize_page(self.page.page_type)
-        new_node = new_page.get_node()
-
-        for i in range(cell_index+1, self.number_of_cells):
-            new_node.append_cell_from(self, self.cells[i])
-        while len(self.cells) > cell_index:
-            self.delete(len(self.cells) - 1)
-
-        return new_node, cell_block
-
     def to_cell_block(self, rowid, key):
-        r = self._pack_record(key, rowid)
-        cell_in_page_bytes = self.calculate_cell_in_page_bytes(len(r))
-        if cell_in_page_bytes == len(r):    # enough space
-            return r
-        return self._first_payload_and_trailing(r)
-
-    def find_cell_index(self, key, index_schema):
-        cell_index = 0
-        for i, cell in enumerate(self.cells):
-            record = decode_payload(cell.cell_payload.get_payload_with_overflow())
-            _cmp = self._cmp_key(key, record, range(len(key)), index_schema.orders)
-            if _cmp < 0:
-                break
-            cell_index = i + 1
-        return cell_index
+        payload = pack_value_list(key + [rowid])
+        # payload length is not a part of the payload spilled to overflow pages
+        return to_varint(len(payload)) + self._first_payload_and_trailing(payload)
 
     def insert(self, rowid, key, cell_index, cell_block):
         self.insert_cell_block(cell_index, cell_block)
 
-    def _parse_index_leaf(self, cell_pointer):
-        payload_len, next_i = varint_and_next_index(self.page.data, cell_pointer)
-        return CellPayload(self, cell_pointer, payload_len, self.page.data[next_i:])
-
     def max_in_page_payload(self):
-        return ((self.pager.page_size-12)*64//255)-2
+        return ((self.pager.page_size-12)*64//255)-23
 
     def find_rowid_index_path(self, key, rowid, orders, ancestors, recurse_to_leaf):
         for i, cell in enumerate(self.cells):
@@ -780,27 +1096,21 @@ class IndexLeafNode(BTreeNode, LeafNodeMixIn):
 
         return ancestors, self, len(self.cells), False
 
-    def index_range_records(self, min_key, max_key, orders, positions, converter):
-        for cell in self.cells:
-            record = decode_payload(cell.cell_payload.get_payload_with_overflow())
-            if self._cmp_key(min_key, record, positions, orders) > 0:
-                continue
-            elif self._cmp_key(max_key, record, positions, orders) < 0:
-                break
-            yield converter(None, record)
-
-    def records(self, converter):
-        for cell in self.cells:
-            yield converter(None, decode_payload(cell.cell_payload.get_payload_with_overflow()))
-
 
 class IndexInteriorNode(BTreeNode, InteriorNodeMixIn):
+    interior_page_type = BTREE_PAGE_TYPE_INTERIOR_INDEX
+
     @classmethod
     def new_node(cls, pager):
         return pager.new_page(BTREE_PAGE_TYPE_INTERIOR_INDEX).get_node()
 
     def _update_cells(self):
-        self.cells = [IndexInteriorCell(self, c) for c in self.read_cell_pointers()]
+        self.cells = CellList(self, IndexInteriorCell)
+
+    def _split_cell_blocks(self, cell_blocks, i):
+        # left child of the median becomes right_most of the left node
+        median = cell_blocks[i]
+        return cell_blocks[:i], int.from_bytes(median[:4], 'big'), median[4:], cell_blocks[i+1:]
 
     def __init__(self, page):
         super().__init__(page)
@@ -817,33 +1127,8 @@ class IndexInteriorNode(BTreeNode, InteriorNodeMixIn):
         packed = pack_value_list(value_list)
         return left_pgno.to_bytes(4, "big") + to_varint(len(packed)) + packed
 
-    def split_by_median(self, ancestors):
-        assert self.number_of_cells >= 3
-        cell_index = self.number_of_cells - self.number_of_cells // 2
-        left_page = self.cells[cell_index].left_page
-
-        # create new empty node
-        new_page = self.page.pager.new_page()
-        new_page.initialize_page(self.page.page_type)
-        new_node = new_page.get_node()
-
-        for i in range(cell_index+1, self.number_of_cells):
-            new_node.append_cell_from(self, self.cells[i])
-        while len(self.cells) > cell_index:
-            self.delete(len(self.cells) - 1)
-        new_node.right_most = self.right_most
-        self.right_most = left_page
-        if len(ancestors) == 0:
-            parent = IndexInteriorNode.new_node(self.page.pager)
-            elder, parent = swap_node(parent, self)
-            new_node, elder = swap_node(elder, new_node)
-        else:
-            # TODO:
-            raise NotImplementedError()
-        return
-
     def max_in_page_payload(self):
-        return ((self.pager.page_size-12)*64//255)-2
+        return ((self.pager.page_size-12)*64//255)-23
 
     def find_rowid_index_path(self, key, rowid, orders, ancestors, recurse_to_leaf):
         for i, cell in enumerate(self.cells):
@@ -873,35 +1158,6 @@ class IndexInteriorNode(BTreeNode, InteriorNodeMixIn):
         node = self.page.pager.get_page(self.right_most).get_node()
         return node.find_rowid_index_path(key, rowid, orders, ancestors, recurse_to_leaf)
 
-    def index_range_records(self, min_key, max_key, orders, positions, converter):
-        for cell in self.cells:
-            record = decode_payload(cell.cell_payload.get_payload_with_overflow())
-            min_cmp = self._cmp_key(min_key, record, positions, orders)
-            max_cmp = self._cmp_key(max_key, record, positions, orders)
-            if min_cmp == 0 or max_cmp == 0:
-                yield converter(None, record)
-            elif min_cmp > 0:
-                continue
-            elif max_cmp > 0:
-                break
-            node = self.page.pager.get_page(cell.left_page).get_node()
-            for r in node.index_range_records(min_key, max_key, orders, positions, converter):
-                yield r
-        record = decode_payload(self.cells[-1].cell_payload.get_payload_with_overflow())
-        if self._cmp_key(max_key, record, positions, orders) > 0:
-            node = self.page.pager.get_page(self.right_most).get_node()
-            for r in node.index_range_records(min_key, max_key, orders, positions, converter):
-                yield r
-
-    def records(self, converter):
-        for cell in self.cells:
-            node = self.page.pager.get_page(cell.left_page).get_node()
-            for r in node.records(converter):
-                yield r
-        node = self.page.pager.get_page(self.right_most).get_node()
-        for r in node.records(converter):
-            yield r
-
 
 class FreePage(BTreeNode):
     def __init__(self, page):
@@ -947,25 +1203,25 @@ class FreePage(BTreeNode):
         return node
 
     def append_free_page(self, free_page):
-        page = self.pager.get_page(self.pgno)
-        trunk = page.get_node()
-        while self.pager.page_size == 8 + trunk.num_children * 4:
-            if trunk.get_next_trunk() is None:
-                # append new FreePage
-                new_trunk = FreePage(free_page.page)
-                trunk.next_trunk_pgno = new_trunk.page.pgno
-                return
-            trunk = trunk.get_next_trunk()
-        self._write_page(free_page.pgno.to_bytes(4, "big"), 8 + trunk.num_children * 4)
-        trunk.num_children += 1
+        """add free_page to this first trunk.
+        If the trunk is full, free_page becomes new first trunk same as SQLite.
+        """
+        # SQLite doesn't use last 6 entries for compatibility
+        if self.num_children >= self.pager.page_size // 4 - 8:
+            new_trunk = free_page.get_node()
+            new_trunk.next_trunk_pgno = self.pgno
+            self.pager.pgno_first_freelist_trunk = new_trunk.pgno
+            return
+        self._write_page(free_page.pgno.to_bytes(4, "big"), 8 + self.num_children * 4)
+        self.num_children += 1
 
     def pop_free_page(self):
         if self.num_children:
             self.num_children -= 1
             pgno = int.from_bytes(
-                self.page.data[8 + self.num_children * 4:12 + self.num_children * 4]
+                self.page.data[8 + self.num_children * 4:12 + self.num_children * 4], 'big'
             )
-            self.page.data[8 + self.num_children * 4:12 + self.num_children * 4] = b'\x00' * 4
+            self._write_page(b'\x00' * 4, 8 + self.num_children * 4)
             free_page = self.page.pager.get_page(pgno)
         else:
             self.page.pager.pgno_first_freelist_trunk = self.next_trunk_pgno
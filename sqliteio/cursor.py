@@ -0,0 +1,256 @@
+################################################################################
+# MIT License
+#
+# Copyright (c) 2023, 2024 Hajime Nakagami<nakagami@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+################################################################################
+from .record import decode_payload, payload_size
+from .btree import TableLeafNode, TableInteriorNode, IndexLeafNode, IndexInteriorNode
+
+
+__all__ = ("Cursor", )
+
+
+class Cursor:
+    """B-tree cursor with an explicit stack of [node, index] frames.
+    Leaf frame index is cell index.
+    Interior frame index is child index (number_of_cells means right_most),
+    or cell index when the cursor is on the cell of an index interior node.
+    """
+    def __init__(self, pager, pgno):
+        self.pager = pager
+        self.pgno = pgno
+        self.stack = []
+        root = self._get_node(pgno)
+        self.is_index = isinstance(root, (IndexLeafNode, IndexInteriorNode))
+
+    def _get_node(self, pgno):
+        node = self.pager.get_page(pgno).get_node()
+        assert isinstance(node, (TableLeafNode, TableInteriorNode, IndexLeafNode, IndexInteriorNode))
+        return node
+
+    @staticmethod
+    def _is_leaf(node):
+        return isinstance(node, (TableLeafNode, IndexLeafNode))
+
+    def _child_pgno(self, node, i):
+        if i < len(node.cells):
+            cell_pointer = node._cell_pointer(i)
+            return int.from_bytes(node.page.data[cell_pointer:cell_pointer+4], 'big')
+        return node.right_most
+
+    @property
+    def is_valid(self):
+        "cursor points an entry"
+        return len(self.stack) > 0
+
+    def _descend_first(self, node):
+        while not self._is_leaf(node):
+            self.stack.append([node, 0])
+            node = self._get_node(self._child_pgno(node, 0))
+        self.stack.append([node, 0])
+        if len(node.cells) == 0:
+            return self._ascend_next()
+        return True
+
+    def _descend_last(self, node):
+        while not self._is_leaf(node):
+            n = len(node.cells)
+            self.stack.append([node, n])
+            node = self._get_node(self._child_pgno(node, n))
+        self.stack.append([node, len(node.cells) - 1])
+        if len(node.cells) == 0:
+            return self._ascend_prev()
+        return True
+
+    def _ascend_next(self):
+        "move to the entry after the current subtree"
+        self.stack.pop()
+        while self.stack:
+            frame = self.stack[-1]
+            node, i = frame
+            if self.is_index and i < len(node.cells):
+                # interior cell after child i
+                return True
+            if i < len(node.cells):
+                frame[1] = i + 1
+                return self._descend_first(self._get_node(self._child_pgno(node, i + 1)))
+            self.stack.pop()
+        return False
+
+    def _ascend_prev(self):
+        "move to the entry before the current subtree"
+        self.stack.pop()
+        while self.stack:
+            frame = self.stack[-1]
+            node, i = frame
+            if i > 0:
+                frame[1] = i - 1
+                if self.is_index:
+                    # interior cell before child i
+                    return True
+                return self._descend_last(self._get_node(self._child_pgno(node, i - 1)))
+            self.stack.pop()
+        return False
+
+    def first(self):
+        "move to the first entry. Returns False if empty"
+        self.stack = []
+        return self._descend_first(self._get_node(self.pgno))
+
+    def last(self):
+        "move to the last entry. Returns False if empty"
+        self.stack = []
+        return self._descend_last(self._get_node(self.pgno))
+
+    def next(self):
+        "move to the next entry. Returns False at the end"
+        if not self.stack:
+            return False
+        frame = self.stack[-1]
+        node, i = frame
+        if not self._is_leaf(node):
+            # on index interior cell i
+            frame[1] = i + 1
+            return self._descend_first(self._get_node(self._child_pgno(node, i + 1)))
+        if i + 1 < len(node.cells):
+            frame[1] = i + 1
+            return True
+        return self._ascend_next()
+
+    def prev(self):
+        "move to the previous entry. Returns False at the beginning"
+        if not self.stack:
+            return False
+        frame = self.stack[-1]
+        node, i = frame
+        if not self._is_leaf(node):
+            # on index interior cell i
+            return self._descend_last(self._get_node(self._child_pgno(node, i)))
+        if i > 0:
+            frame[1] = i - 1
+            return True
+        return self._ascend_prev()
+
+    def _seek_index(self, node, key, orders, positions, after):
+        "first cell index whose record >= key (> key if after)"
+        lo, hi = 0, len(node.cells)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = decode_payload(node.cells[mid].cell_payload.get_payload_with_overflow())
+            if node._cmp_key(key, record, positions, orders) >= (0 if after else 1):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def seek(self, key, orders=None, positions=None):
+        """move to the first entry >= key.
+        key is rowid for table, value list for index compared with orders and positions.
+        Returns False if there is no such entry.
+        """
+        return self._seek(key, orders, positions, False)
+
+    def seek_last(self, key, orders=None, positions=None):
+        """move to the last entry <= key.
+        Returns False if there is no such entry.
+        """
+        if self._seek(key, orders, positions, True):
+            return self.prev()
+        return self.last()
+
+    def _seek(self, key, orders, positions, after):
+        "move to the first entry >= key (> key if after)"
+        node, i = self.descend(key, orders, positions, after)[-1]
+        if i < len(node.cells):
+            return True
+        # after the last cell of the leaf
+        return self._ascend_next()
+
+    def descend(self, key, orders=None, positions=None, after=False):
+        """make the path from the root to the leaf position of the first entry >= key (> key if after).
+        Returns the stack of [node, index] frames. The leaf index may be the number of cells.
+        """
+        self.stack = []
+        node = self._get_node(self.pgno)
+        if positions is None and self.is_index:
+            positions = range(len(key))
+        while True:
+            if self.is_index:
+                i = self._seek_index(node, key, orders, positions, after)
+            elif self._is_leaf(node):
+                i = node.find_cell_index(key + 1 if after else key)
+            else:
+                i = node._bisect_left(node._key_at, key + 1 if after else key)
+            if self._is_leaf(node):
+                break
+            self.stack.append([node, i])
+            node = self._get_node(self._child_pgno(node, i))
+        self.stack.append([node, i])
+        return self.stack
+
+    def compare(self, key, record, orders, positions=None):
+        """compare key and index record
+        0: key equal record
+        -1: less key than record
+        1: bigger key than record
+        """
+        if positions is None:
+            positions = range(len(key))
+        return self.stack[-1][0]._cmp_key(key, record, positions, orders)
+
+    @property
+    def cell(self):
+        "current cell"
+        node, i = self.stack[-1]
+        return node.cells[i]
+
+    @property
+    def rowid(self):
+        "rowid of current table entry"
+        return self.cell.rowid
+
+    def record(self, positions=None):
+        """decoded value list of current entry.
+        If positions is given, only values at positions are decoded and
+        overflow pages after them are not read.
+        """
+        cell_payload = self.cell.cell_payload
+        if positions is None:
+            return decode_payload(cell_payload.get_payload_with_overflow())
+        size = payload_size(cell_payload.first_payload, positions)
+        return decode_payload(cell_payload.get_payload_with_overflow(size), positions)
+
+    def payload(self, positions=None):
+        """copy of the payload bytes of current entry.
+        If positions is given, overflow pages after values at positions are not read.
+        """
+        cell_payload = self.cell.cell_payload
+        size = None if positions is None else payload_size(cell_payload.first_payload, positions)
+        return bytes(cell_payload.get_payload_with_overflow(size))
+
+    def row(self, converter=lambda rowid, record: (rowid, record), positions=None, lazy=False):
+        """converted current entry.
+        If lazy is True, converter takes the payload bytes instead of the decoded value list.
+        """
+        record = self.payload(positions) if lazy else self.record(positions)
+        if self.is_index:
+            return converter(None, record)
+        return converter(self.rowid, record)
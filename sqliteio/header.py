@@ -0,0 +1,78 @@
+################################################################################
+# MIT License
+#
+# Copyright (c) 2023, 2024 Hajime Nakagami<nakagami@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+################################################################################
+# https://www.sqlite.org/fileformat2.html#the_rollback_journal
+# https://www.sqlite.org/fileformat2.html#the_database_header
+import struct
+
+
+__all__ = ("DatabaseHeader", )
+
+HEADER_SIZE = 100
+HEADER_FORMAT = ">16sHBBBBBBIIIIIIIIIIII20sII"
+HEADER_FIELDS = (
+    "magic",                        # 0
+    "page_size",                    # 16 (1 means 65536)
+    "write_version",                # 18 (2 is WAL mode)
+    "read_version",                 # 19 (2 is WAL mode)
+    "reserved_space",               # 20 unused bytes at the end of each page
+    "max_payload_fraction",         # 21
+    "min_payload_fraction",         # 22
+    "leaf_payload_fraction",        # 23
+    "file_change_counter",          # 24
+    "database_size",                # 28 in pages
+    "pgno_first_freelist_trunk",    # 32
+    "num_freelist_pages",           # 36
+    "schema_cookie",                # 40
+    "schema_format",                # 44
+    "default_cache_size",           # 48
+    "largest_root_btree",           # 52
+    "text_encoding",                # 56
+    "user_version",                 # 60
+    "incremental_vacuum",           # 64
+    "application_id",               # 68
+    "reserved",                     # 72 reserved for expansion
+    "version_valid_for",            # 92
+    "sqlite_version",               # 96
+)
+TEXT_ENCODINGS = {1: "utf-8", 2: "utf-16le", 3: "utf-16be"}
+
+
+class DatabaseHeader:
+    "parsed 100 bytes database header"
+    def __init__(self, data):
+        for name, v in zip(HEADER_FIELDS, struct.unpack_from(HEADER_FORMAT, data, 0)):
+            setattr(self, name, v)
+
+    def pack(self):
+        return struct.pack(HEADER_FORMAT, *[getattr(self, name) for name in HEADER_FIELDS])
+
+    @property
+    def encoding(self):
+        "text encoding name"
+        return TEXT_ENCODINGS.get(self.text_encoding, "utf-8")
+
+    def __repr__(self):
+        return "DatabaseHeader({})".format(
+            ", ".join(["{}={!r}".format(name, getattr(self, name)) for name in HEADER_FIELDS[1:]])
+        )
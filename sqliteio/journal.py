@@ -0,0 +1,124 @@
+################################################################################
+# MIT License
+#
+# Copyright (c) 2023, 2024 Hajime Nakagami<nakagami@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+################################################################################
+# https://www.sqlite.org/fileformat2.html#the_rollback_journal
+import os
+import struct
+
+
+__all__ = ("RollbackJournal", "fsync")
+
+JOURNAL_MAGIC = b"\xd9\xd5\x05\xf9\x20\xa1\x63\xd7"
+SECTOR_SIZE = 512
+
+
+def fsync(fileobj):
+    "flush file object and sync to storage if possible"
+    fileobj.flush()
+    if hasattr(os, "fsync"):
+        try:
+            os.fsync(fileobj.fileno())
+        except (AttributeError, OSError):
+            pass
+
+
+def _nonce():
+    try:
+        return int.from_bytes(os.urandom(4), 'big')
+    except (AttributeError, NotImplementedError):
+        import random
+        return random.getrandbits(32)
+
+
+def _checksum(nonce, data):
+    "same as pager_cksum() in sqlite3"
+    cksum = nonce
+    i = len(data) - 200
+    while i > 0:
+        cksum += data[i]
+        i -= 200
+    return cksum & 0xffffffff
+
+
+class RollbackJournal:
+    def __init__(self, path, page_size):
+        self.path = path
+        self.page_size = page_size
+
+    def write(self, db_size, records):
+        """write original page records and sync.
+        db_size is number of pages before commit, records is list of (pgno, original data)
+        """
+        nonce = _nonce()
+        header = JOURNAL_MAGIC + struct.pack(">IIIII", len(records), nonce, db_size, SECTOR_SIZE, self.page_size)
+        with open(self.path, "wb") as f:
+            f.write(header + b'\x00' * (SECTOR_SIZE - len(header)))
+            for pgno, data in records:
+                f.write(pgno.to_bytes(4, "big"))
+                f.write(data)
+                f.write(_checksum(nonce, data).to_bytes(4, "big"))
+            fsync(f)
+
+    def exists(self):
+        try:
+            os.stat(self.path)
+        except OSError:
+            return False
+        return True
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def playback(self, vfs):
+        """rollback database storage with hot journal and delete the journal.
+        Returns True if rolled back
+        """
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            return False
+        with f:
+            header = f.read(28)
+            if len(header) < 28 or header[:8] != JOURNAL_MAGIC:
+                return False
+            nrec, nonce, db_size, sector_size, page_size = struct.unpack(">IIIII", header[8:])
+            if nrec == 0xffffffff:
+                f.seek(0, 2)
+                nrec = (f.tell() - sector_size) // (page_size + 8)
+            f.seek(sector_size, 0)
+            for _ in range(nrec):
+                rec = f.read(page_size + 8)
+                if len(rec) < page_size + 8:
+                    break
+                pgno = int.from_bytes(rec[:4], 'big')
+                data = rec[4:page_size+4]
+                if int.from_bytes(rec[page_size+4:], 'big') != _checksum(nonce, data):
+                    break
+                vfs.write((pgno - 1) * page_size, data)
+        vfs.truncate(db_size * page_size)
+        vfs.sync()
+        self.delete()
+        return True
@@ -22,6 +22,7 @@
 # SOFTWARE.
 ################################################################################
 import binascii
+from collections import OrderedDict
 from .btree import (
     BTREE_PAGE_TYPE_LEAF_TABLE,
     BTREE_PAGE_TYPE_INTERIOR_TABLE,
@@ -36,18 +37,84 @@ from .btree import (
     FreePage,
     RawPage,
 )
+from .cursor import Cursor
+from .header import DatabaseHeader
+from .journal import RollbackJournal
+from .vfs import BusyError
+from .wal import WriteAheadLog
 
 
-__all__ = ("Page", "Pager")
+__all__ = ("Page", "Pager", "PagerStats", "DEFAULT_CACHE_SIZE")
+
+# Same meaning as SQLite's PRAGMA cache_size.
+# positive value is number of pages, negative value is KiB.
+DEFAULT_CACHE_SIZE = -2000
+
+JOURNAL_MODES = ("delete", "off", "wal")
+
+NODE_CLASSES = {
+    BTREE_PAGE_TYPE_LEAF_TABLE: TableLeafNode,
+    BTREE_PAGE_TYPE_INTERIOR_TABLE: TableInteriorNode,
+    BTREE_PAGE_TYPE_LEAF_INDEX: IndexLeafNode,
+    BTREE_PAGE_TYPE_INTERIOR_INDEX: IndexInteriorNode,
+    BTREE_PAGE_TYPE_FREE_PAGE: FreePage,
+    BTREE_PAGE_TYPE_RAW_PAGE: RawPage,
+}
+
+
+class PagerStats:
+    """I/O and cache counters broken down by page type (node class name).
+    stats.page_reads is total count, stats.by_type("page_reads") is dict of page type -> count.
+    """
+    names = (
+        "page_reads",
+        "cache_hits",
+        "cache_misses",
+        "pages_written",
+        "bytes_read",
+        "bytes_written",
+        "overflow_pages",
+        "node_parses",
+    )
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        "set all counters to 0"
+        self.counters = {name: {} for name in self.names}
+
+    def count(self, name, page_type, n=1):
+        counter = self.counters[name]
+        counter[page_type] = counter.get(page_type, 0) + n
+
+    def by_type(self, name):
+        return dict(self.counters[name])
+
+    def as_dict(self):
+        return {name: self.by_type(name) for name in self.names}
+
+    def __getattr__(self, name):
+        if name in self.names:
+            return sum(self.counters[name].values())
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return "PagerStats({})".format(", ".join(["{}={}".format(name, getattr(self, name)) for name in self.names]))
 
 
 class Page:
     def __init__(self, pager, pgno, data, page_type):
         self.pager = pager
         self.pgno = pgno
-        self.data = bytearray(data)
+        if isinstance(data, memoryview):
+            # read only slice of mmap, copy on write
+            self.data = data
+        else:
+            self.data = bytearray(data)
         self.page_type = page_type
         self.is_dirty = False
+        self._node = None           # parsed node cache
 
         self.page_offset = 0
         if self.pgno == 1:
@@ -80,15 +147,27 @@ class Page:
         if self._is_dirty:
             self.pager.set_page(self)
 
+    def _copy_on_write(self):
+        if not isinstance(self.data, bytearray):
+            self.data = bytearray(self.data)
+
+    def invalidate_node(self):
+        "discard parsed node cache"
+        self._node = None
+
     def write(self, data, offset):
         "Write data"
+        self._copy_on_write()
+        self._node = None
         self.data[offset:offset + len(data)] = data
         self.is_dirty = True
 
     def initialize_page(self, page_type):
         "Initialize page as page_type page"
+        self._copy_on_write()
+        self._node = None
         self.page_type = page_type
-        self.data[self.page_offset:self.pager.page_size-self.page_offset] = b'\x00' * (self.pager.page_size-self.page_offset)
+        self.data[self.page_offset:self.pager.page_size] = b'\x00' * (self.pager.page_size-self.page_offset)
         if page_type in (
             BTREE_PAGE_TYPE_LEAF_TABLE,
             BTREE_PAGE_TYPE_INTERIOR_TABLE,
@@ -98,39 +177,94 @@ class Page:
             self.data[self.page_offset] = page_type
         self.is_dirty = True
 
+    @property
+    def type_name(self):
+        "node class name of the page"
+        return NODE_CLASSES[self.page_type].__name__
+
     def get_node(self):
-        "Get page btree node instance"
-        return {
-            BTREE_PAGE_TYPE_LEAF_TABLE: TableLeafNode,
-            BTREE_PAGE_TYPE_INTERIOR_TABLE: TableInteriorNode,
-            BTREE_PAGE_TYPE_LEAF_INDEX: IndexLeafNode,
-            BTREE_PAGE_TYPE_INTERIOR_INDEX: IndexInteriorNode,
-            BTREE_PAGE_TYPE_FREE_PAGE: FreePage,
-            BTREE_PAGE_TYPE_RAW_PAGE: RawPage,
-        }[self.page_type](self)
+        "Get page btree node instance. parsed node is reused until the page is written"
+        if self._node is None:
+            node_class = NODE_CLASSES[self.page_type]
+            self.pager.stats.count("node_parses", node_class.__name__)
+            self._node = node_class(self)
+        return self._node
 
     def __str__(self):
         return "page{}".format(self.pgno)
 
 
 class Pager:
-    def __init__(self, database):
+    def __init__(self, database, vfs, cache_size=DEFAULT_CACHE_SIZE, journal_mode="delete"):
+        if journal_mode not in JOURNAL_MODES:
+            vfs.close()
+            raise ValueError("Invalid journal_mode: {}".format(journal_mode))
         self.database = database
-        self.pages = {}
-
-        self.database.fileobj.seek(0, 0)
-        magic = self.database.fileobj.read(16)
-        if magic != b"SQLite format 3\x00":
-            self.database.fileobj.close()
+        self.vfs = vfs
+        self.journal_mode = journal_mode
+        self.pages = {}             # dirty pages
+        self.cache = OrderedDict()  # clean pages in LRU order
+        self.wal = None
+        self.stats = PagerStats()
+        self._header = None
+        self.header_is_dirty = False
+
+        header = self.vfs.read(0, 20)
+        if header[:16] != b"SQLite format 3\x00":
+            self.vfs.close()
             raise ValueError("Invalid Magic header")
-        self.page_size = int.from_bytes(self.database.fileobj.read(2), 'big')
+        self.page_size = int.from_bytes(header[16:18], 'big')
         if self.page_size == 1:
             self.page_size = 65536
-        self.database.fileobj.seek(0, 2)
-        file_size = self.database.fileobj.tell()
+        self.vfs.page_size = self.page_size
+        # file format write/read version 2 is WAL mode
+        write_version, read_version = header[18], header[19]
+
+        self.journal = None
+        name = self.vfs.name
+        if name is not None and self.vfs.writable():
+            journal = RollbackJournal(name + "-journal", self.page_size)
+            if journal.exists():
+                self._playback_hot_journal(journal)
+            if journal_mode == "delete" and read_version != 2:
+                self.journal = journal
+
+        # WAL mode database always uses WAL
+        self.to_wal_mode = journal_mode == "wal" and read_version != 2
+        if name is not None and (read_version == 2 or journal_mode == "wal"):
+            self.wal = WriteAheadLog(name + "-wal", self.page_size)
+            self.wal.load()
+        elif journal_mode == "wal":
+            raise ValueError("WAL mode needs database file name")
+        elif read_version == 2 and self.vfs.persistent:
+            # committed pages in the WAL file can't be read
+            self.vfs.close()
+            raise ValueError("WAL mode database needs database file name")
+
+        file_size = self._file_size()
         if file_size % self.page_size != 0:
             raise ValueError("Invalid File size: {}".format(file_size))
-        self.max_pgno = file_size // self.page_size
+        self.max_pgno = self._db_size()
+        if cache_size < 0:
+            self.cache_size = (-cache_size * 1024) // self.page_size
+        else:
+            self.cache_size = cache_size
+
+    def _playback_hot_journal(self, journal):
+        """rollback database with the journal if it is hot, same as hasHotJournal() in sqlite3.
+        The journal of another connection in the middle of a transaction (RESERVED lock) is left alone.
+        """
+        try:
+            self.vfs.lock()
+            if self.vfs.check_reserved_lock():
+                return
+            self.vfs.lock(exclusive=True)
+            journal.playback(self.vfs)
+        except BusyError:
+            # another connection is writing the database
+            pass
+        finally:
+            self.vfs.unlock()
 
     def _dump(self):
         print("  page_size=", self.page_size)
@@ -140,21 +274,54 @@ class Pager:
         print("  num_freelist_pages=", self.num_freelist_pages)
         print("  max_pgno=", self.max_pgno)
 
-    def _read_header(self, offset):
-        page = self.get_page(1)
-        return int.from_bytes(page.data[offset:offset+4], 'big')
+    def _file_size(self):
+        return self.vfs.size()
 
-    def _write_header(self, v, offset):
-        page = self.get_page(1)
-        for i, c in enumerate(v.to_bytes(4, "big")):
-            page.data[offset+i] = c
-        page.is_dirty = True
+    def _db_size(self):
+        "database size in pages"
+        if self.wal is not None and self.wal.db_size:
+            return self.wal.db_size
+        return self._file_size() // self.page_size
+
+    @property
+    def header(self):
+        "database header parsed from page 1 once"
+        if self._header is None:
+            self._header = DatabaseHeader(self.get_page(1).data)
+        return self._header
+
+    def _read_header(self, name):
+        return getattr(self.header, name)
+
+    def _write_header(self, v, name):
+        setattr(self.header, name, v)
+        if not self.header_is_dirty:
+            # pin page 1 until the header is written back at flush()
+            self.header_is_dirty = True
+            self.get_page(1).is_dirty = True
+
+    def _update_change_counter(self):
+        "same as pager_write_changecounter() in sqlite3"
+        self.file_change_counter = (self.file_change_counter + 1) & 0xffffffff
+        self.header_btree_count = self.max_pgno
+        self._write_header(self.file_change_counter, "version_valid_for")
 
     def set_page(self, page):
+        "pin dirty page until flush() or rollback()"
+        self.cache.pop(page.pgno, None)
         self.pages[page.pgno] = page
 
     def remove_page(self, pgno):
-        self.pages[pgno] = None
+        self.pages.pop(pgno, None)
+        self.cache.pop(pgno, None)
+
+    def _cache_page(self, page):
+        "keep clean page and evict least recently used pages"
+        if self.cache_size <= 0:
+            return
+        self.cache[page.pgno] = page
+        while len(self.cache) > self.cache_size:
+            self.cache.pop(next(iter(self.cache)), None)
 
     def find_rowid_table_path(self, pgno, rowid):
         """find ancestors TableInteriorNode list, TableLeafNode and cell index in that TableLeafNode
@@ -170,74 +337,179 @@ class Pager:
         """
         return self.get_page(pgno).get_node().find_rowid_index_path(key, rowid, orders, [], recurse_to_leaf)
 
-    def rowid_range_records(self, pgno, min_rowid, max_rowid, converter=lambda rowid, record: (rowid, record)):
-        "fetch table records by rowid range"
-        return self.get_page(pgno).get_node().rowid_range_records(min_rowid, max_rowid, converter)
+    def cursor(self, pgno):
+        "Cursor of pgno table/index tree"
+        return Cursor(self, pgno)
 
-    def index_range_records(
-        self, pgno, min_key, max_key, orders, positions, converter=lambda rowid, record: (rowid, record)
+    def rowid_range_records(
+        self, pgno, min_rowid, max_rowid, converter=lambda rowid, record: (rowid, record), reverse=False,
+        positions=None, lazy=False
     ):
-        "fetch table records by index range"
-        node = self.get_page(pgno).get_node()
-        return node.index_range_records(min_key, max_key, orders, positions, converter)
+        """fetch table records by rowid range. If reverse is True, from max_rowid to min_rowid
+        If positions is given, only values at positions are decoded.
+        If lazy is True, converter takes the payload bytes.
+        """
+        cursor = self.cursor(pgno)
+        if reverse:
+            valid = cursor.seek_last(max_rowid)
+            while valid and cursor.rowid >= min_rowid:
+                yield cursor.row(converter, positions, lazy)
+                valid = cursor.prev()
+        else:
+            valid = cursor.seek(min_rowid)
+            while valid and cursor.rowid <= max_rowid:
+                yield cursor.row(converter, positions, lazy)
+                valid = cursor.next()
 
-    def records(self, pgno, converter=lambda rowid, record: (rowid, record)):
-        "fetch pgno table/index tree all records"
-        return self.get_page(pgno).get_node().records(converter)
+    def index_range_records(
+        self, pgno, min_key, max_key, orders, positions, converter=lambda rowid, record: (rowid, record), reverse=False,
+        lazy=False
+    ):
+        """fetch table records by index range. If reverse is True, from max_key to min_key
+        If lazy is True, converter takes the payload bytes.
+        """
+        cursor = self.cursor(pgno)
+        if reverse:
+            valid = cursor.seek_last(max_key, orders, positions)
+            while valid:
+                record = cursor.record()
+                if cursor.compare(min_key, record, orders, positions) > 0:
+                    break
+                yield cursor.row(converter, lazy=True) if lazy else converter(None, record)
+                valid = cursor.prev()
+        else:
+            valid = cursor.seek(min_key, orders, positions)
+            while valid:
+                record = cursor.record()
+                if cursor.compare(max_key, record, orders, positions) < 0:
+                    break
+                yield cursor.row(converter, lazy=True) if lazy else converter(None, record)
+                valid = cursor.next()
+
+    def records(
+        self, pgno, converter=lambda rowid, record: (rowid, record), reverse=False, positions=None, lazy=False
+    ):
+        """fetch pgno table/index tree all records. If reverse is True, from the last record
+        If positions is given, only values at positions are decoded.
+        If lazy is True, converter takes the payload bytes.
+        """
+        cursor = self.cursor(pgno)
+        if reverse:
+            valid = cursor.last()
+            while valid:
+                yield cursor.row(converter, positions, lazy)
+                valid = cursor.prev()
+        else:
+            valid = cursor.first()
+            while valid:
+                yield cursor.row(converter, positions, lazy)
+                valid = cursor.next()
 
     # header variables
     @property
     def file_change_counter(self):
-        return self._read_header(24)
+        return self._read_header("file_change_counter")
 
     @file_change_counter.setter
-    def filechange_counter(self, v):
-        self._write_header(v, 24)
+    def file_change_counter(self, v):
+        self._write_header(v, "file_change_counter")
 
     @property
     def header_btree_count(self):
-        return self._read_header(28)
+        "database size in pages"
+        return self._read_header("database_size")
 
     @header_btree_count.setter
     def header_btree_count(self, v):
-        self._write_header(v, 28)
+        self._write_header(v, "database_size")
 
     @property
     def pgno_first_freelist_trunk(self):
-        return self._read_header(32)
+        return self._read_header("pgno_first_freelist_trunk")
 
     @pgno_first_freelist_trunk.setter
     def pgno_first_freelist_trunk(self, v):
-        self._write_header(v, 32)
+        self._write_header(v, "pgno_first_freelist_trunk")
 
     @property
     def num_freelist_pages(self):
-        return self._read_header(36)
+        return self._read_header("num_freelist_pages")
 
     @num_freelist_pages.setter
     def num_freelist_pages(self, v):
-        self._write_header(v, 36)
+        self._write_header(v, "num_freelist_pages")
+
+    @property
+    def schema_cookie(self):
+        return self._read_header("schema_cookie")
+
+    @schema_cookie.setter
+    def schema_cookie(self, v):
+        self._write_header(v, "schema_cookie")
+
+    @property
+    def user_version(self):
+        return self._read_header("user_version")
+
+    @user_version.setter
+    def user_version(self, v):
+        self._write_header(v, "user_version")
+
+    @property
+    def text_encoding(self):
+        "utf-8, utf-16le or utf-16be"
+        return self.header.encoding
+
+    @property
+    def reserved_space(self):
+        "unused bytes at the end of each page"
+        return self._read_header("reserved_space")
 
     # end of header variables
 
     def close(self, ):
-        self.database.fileobj.close()
+        self.pages = {}
+        self.cache.clear()
+        if self.wal is not None:
+            self.wal.close()
+        self.vfs.close()
         self.database.fileobj = None
 
     def get_page(self, pgno, page_type=None):
         "get pgno page"
         if pgno <= self.max_pgno:
-            if not (page := self.pages.get(pgno)):
-                # read page block
-                self.database.fileobj.seek((pgno - 1) * self.page_size, 0)
-                page = Page(self, pgno, self.database.fileobj.read(self.page_size), page_type)
+            if page := self.pages.get(pgno):
+                self.stats.count("cache_hits", page.type_name)
+                return page
+            if page := self.cache.get(pgno):
+                # most recently used
+                self.cache.pop(pgno, None)
+                self.cache[pgno] = page
+                if page_type is not None and page.page_type != page_type:
+                    page.page_type = page_type
+                    page.invalidate_node()
+                self.stats.count("cache_hits", page.type_name)
+                return page
+            page = Page(self, pgno, self._read_page(pgno), page_type)
+            type_name = page.type_name
+            self.stats.count("cache_misses", type_name)
+            self.stats.count("page_reads", type_name)
+            self.stats.count("bytes_read", type_name, len(page.data))
+            self._cache_page(page)
             return page
         return None
 
+    def _read_page(self, pgno):
+        "read page block"
+        if self.wal is not None and (data := self.wal.read_page(pgno)) is not None:
+            return data
+        return self.vfs.read_page(pgno)
+
     def move_page(self, from_pgno, to_pgno):
         page = self.get_page(from_pgno)
         self.remove_page(from_pgno)
         page.pgno = to_pgno
+        page.invalidate_node()
         page.is_dirty = True
 
     def _first_freelist_trunk(self):
@@ -250,6 +522,7 @@ class Pager:
         freelist_trunk = self._first_freelist_trunk()
         if freelist_trunk:
             page = freelist_trunk.pop_free_page()
+            self.num_freelist_pages -= 1
         else:
             self.max_pgno += 1
             pgno = self.max_pgno
@@ -265,21 +538,93 @@ class Pager:
             self.pgno_first_freelist_trunk = page.pgno
         else:
             freelist_trunk.append_free_page(page)
+        self.num_freelist_pages += 1
 
     def rollback(self):
         self.pages = {}
-        self.database.fileobj.seek(0, 2)
-        self.max_pgno = self.database.fileobj.tell() // self.page_size
+        self.cache.clear()
+        self._header = None
+        self.header_is_dirty = False
+        if self.wal is not None:
+            # see the latest commit
+            self.wal.load()
+        self.max_pgno = self._db_size()
+
+    def _to_wal_mode(self):
+        "set file format version 2 (WAL mode) to database header"
+        self._write_header(2, "write_version")
+        self._write_header(2, "read_version")
+        self.vfs.write(18, b'\x02\x02')
+        self.vfs.sync()
+        self.to_wal_mode = False
 
     def flush(self):
         "flush dirty pages"
-        for pgno, page in self.pages.items():
+        if (
+            self.pages and self.wal is None and self.journal is None and self.journal_mode == "delete"
+            and self.vfs.persistent and self.vfs.writable()
+        ):
+            raise ValueError('rollback journal needs database file name, or use journal_mode="off"')
+        if self.to_wal_mode and self.pages:
+            self._to_wal_mode()
+        if self.pages and (self.wal is None or 1 in self.pages or self.header_btree_count != self.max_pgno):
+            # WAL commit also keeps the database size in the header valid when the file grows
+            self._update_change_counter()
+        if self.header_is_dirty:
+            self.get_page(1).write(self.header.pack(), 0)
+            self.header_is_dirty = False
+        pages = sorted(self.pages.items(), key=lambda item: item[0])
+        dirty_pages = []
+        for pgno, page in pages:
             if page.is_dirty:
-                self.database.fileobj.seek((pgno-1) * self.page_size, 0)
-                self.database.fileobj.write(page.data)
-                page.is_dirty = False
-        self.database.fileobj.flush()
+                dirty_pages.append((pgno, page.data))
+                self.stats.count("pages_written", page.type_name)
+                self.stats.count("bytes_written", page.type_name, len(page.data))
+        if self.wal is not None:
+            if dirty_pages:
+                self.wal.append(dirty_pages, self.max_pgno)
+        elif dirty_pages:
+            self.vfs.lock(exclusive=True)
+            try:
+                if self.journal is not None:
+                    # save original pages before overwrite
+                    db_size = self._file_size() // self.page_size
+                    records = []
+                    for pgno, page in pages:
+                        if page.is_dirty and pgno <= db_size:
+                            records.append((pgno, bytes(self.vfs.read_page(pgno))))
+                            self.stats.count("page_reads", page.type_name)
+                            self.stats.count("bytes_read", page.type_name, self.page_size)
+                    self.journal.write(db_size, records)
+                self.vfs.write_pages(dirty_pages)
+                if self.journal is not None:
+                    self.vfs.sync()
+                    self.journal.delete()
+            finally:
+                self.vfs.unlock()
+        for pgno, page in pages:
+            page.is_dirty = False
         self.pages.clear()
+        # flushed pages are clean now
+        for pgno, page in pages:
+            if pgno == page.pgno:
+                self._cache_page(page)
+
+    def checkpoint(self):
+        "copy committed WAL frames to database file"
+        if self.wal is None or not self.wal.frames:
+            return
+        pages = [(pgno, self.wal.read_page(pgno)) for pgno in sorted(self.wal.frames.keys())]
+        for pgno, data in pages:
+            type_name = NODE_CLASSES.get(data[100 if pgno == 1 else 0], RawPage).__name__
+            self.stats.count("page_reads", type_name)
+            self.stats.count("bytes_read", type_name, len(data))
+            self.stats.count("pages_written", type_name)
+            self.stats.count("bytes_written", type_name, len(data))
+        self.vfs.write_pages(pages)
+        self.vfs.truncate(self.wal.db_size * self.page_size)
+        self.vfs.sync()
+        self.wal.restart()
 
     def __exit__(self, exc, value, traceback):
         self.close()
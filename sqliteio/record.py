@@ -21,10 +21,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 ################################################################################
+import array
 import struct
 
 
-__all__ = ("varint_and_next_index", "to_varint", "decode_payload", "pack_value_list")
+__all__ = ("varint_and_next_index", "to_varint", "decode_payload", "payload_size", "pack_value_list", "Row")
 
 
 def varint_and_next_index(b, i):
@@ -55,51 +56,206 @@ def to_varint(n: int) -> bytearray:
     return bytearray(varint)
 
 
-def _decode_error(body):
-    raise ValueError("decode_record()")
+# byte length of value of serial type 0 to 11
+_SERIAL_TYPE_SIZES = (0, 1, 2, 3, 4, 6, 8, 8, 0, 0, 0, 0)
 
 
-_decoders = {
-    0: lambda body: (None, body),
-    1: lambda body: (body[0], body[1:]),
-    2: lambda body: (int.from_bytes(body[:2], 'big'), body[2:]),
-    3: lambda body: (int.from_bytes(body[:3], 'big'), body[3:]),
-    4: lambda body: (int.from_bytes(body[:4], 'big'), body[4:]),
-    5: lambda body: (int.from_bytes(body[:6], 'big'), body[6:]),
-    6: lambda body: (int.from_bytes(body[:8], 'big'), body[8:]),
-    7: lambda body: (struct.unpack(">d", body[:8])[0], body[8:]),
-    8: lambda body: (0, body),
-    9: lambda body: (1, body),
-    10: _decode_error,
-    11: _decode_error,
-}
-
-
-def decode_payload(payload):
-    "Convert a record to value list"
-    res = []
+def payload_size(payload, positions):
+    """bytes of the payload needed to decode values up to the last of positions.
+    payload may be the first part of the payload, None if the record header is not in it.
+    """
+    n, i = varint_and_next_index(payload, 0)
+    if n > len(payload):
+        return None
+    last = max(positions) if positions else -1
+    j = n
+    k = 0
+    while i < n and k <= last:
+        c, i = varint_and_next_index(payload, i)
+        j += ((c - 12) >> 1) if c >= 12 else _SERIAL_TYPE_SIZES[c]
+        k += 1
+    return j
+
 
+def decode_payload(payload, positions=None):
+    """Convert a record to value list.
+    Header and body are read with offsets, only value bytes are copied.
+    If positions is given, only values at positions are decoded,
+    values at other positions are None and values after the last position are omitted.
+    """
+    if positions is not None:
+        return _decode_positions(payload, positions)
+    res = []
     n, i = varint_and_next_index(payload, 0)
-    header, body = payload[i:n], payload[n:]
+    j = n   # offset of the value in body
 
-    while header:
-        c, i = varint_and_next_index(header, 0)
-        header = header[i:]
+    while i < n:
+        c = payload[i]
+        if c < 0x80:
+            i += 1
+        else:
+            c, i = varint_and_next_index(payload, i)
         if c >= 12:
             if c & 1:
                 # string
                 ln = (c - 13) >> 1
-                v, body = body[:ln].decode('utf-8'), body[ln:]
+                res.append(str(payload[j:j+ln], 'utf-8'))
             else:
                 # blob
                 ln = (c - 12) >> 1
-                v, body = bytes(body[:ln]), body[ln:]
+                res.append(bytes(payload[j:j+ln]))
+            j += ln
+        elif c == 1:
+            v = payload[j]
+            res.append(v - 256 if v > 127 else v)
+            j += 1
+        elif c == 0:
+            res.append(None)
+        elif c < 7:
+            # big-endian twos-complement integer
+            ln = _SERIAL_TYPE_SIZES[c]
+            v = int.from_bytes(payload[j:j+ln], 'big')
+            if v >> (ln * 8 - 1):
+                v -= 1 << (ln * 8)
+            res.append(v)
+            j += ln
+        elif c == 7:
+            res.append(struct.unpack_from(">d", payload, j)[0])
+            j += 8
+        elif c == 8:
+            res.append(0)
+        elif c == 9:
+            res.append(1)
         else:
-            v, body = _decoders[c](body)
-        res.append(v)
+            raise ValueError("decode_record()")
     return res
 
 
+def _decode_value(payload, c, j):
+    "decode a value of serial type c at offset j"
+    if c >= 12:
+        if c & 1:
+            return str(payload[j:j+((c - 13) >> 1)], 'utf-8')
+        return bytes(payload[j:j+((c - 12) >> 1)])
+    elif c == 0:
+        return None
+    elif c < 7:
+        ln = _SERIAL_TYPE_SIZES[c]
+        v = int.from_bytes(payload[j:j+ln], 'big')
+        if v >> (ln * 8 - 1):
+            v -= 1 << (ln * 8)
+        return v
+    elif c == 7:
+        return struct.unpack_from(">d", payload, j)[0]
+    elif c == 8:
+        return 0
+    elif c == 9:
+        return 1
+    raise ValueError("decode_record()")
+
+
+def _decode_positions(payload, positions):
+    "decode_payload() which decodes values at positions only"
+    res = []
+    n, i = varint_and_next_index(payload, 0)
+    j = n
+    last = max(positions) if positions else -1
+    while i < n and len(res) <= last:
+        c, i = varint_and_next_index(payload, i)
+        res.append(_decode_value(payload, c, j) if len(res) in positions else None)
+        j += ((c - 12) >> 1) if c >= 12 else _SERIAL_TYPE_SIZES[c]
+    return res
+
+
+def _value_offsets(payload):
+    "array of header offset of the serial type and body offset of each value, interleaved"
+    offsets = array.array('I')
+    n, i = varint_and_next_index(payload, 0)
+    j = n
+    while i < n:
+        offsets.append(i)
+        offsets.append(j)
+        c, i = varint_and_next_index(payload, i)
+        j += ((c - 12) >> 1) if c >= 12 else _SERIAL_TYPE_SIZES[c]
+    return offsets
+
+
+_NOT_DECODED = object()
+
+
+class Row:
+    """record backed by the payload bytes.
+    A value is decoded on first access by column name, as mapping or as attribute.
+    columns is (names, record positions, name to index dict) shared by rows of a table.
+    record position None means rowid.
+    """
+    __slots__ = ("_columns", "_rowid", "_payload", "_offsets", "_values")
+
+    def __init__(self, columns, rowid, payload):
+        self._columns = columns
+        self._rowid = rowid
+        self._payload = payload
+        self._offsets = None
+        self._values = None
+
+    def __getitem__(self, name):
+        names, positions, index = self._columns
+        i = index[name]
+        if self._values is None:
+            self._values = [_NOT_DECODED] * len(names)
+        v = self._values[i]
+        if v is _NOT_DECODED:
+            pos = positions[i]
+            if pos is None:
+                v = self._rowid
+            else:
+                if self._offsets is None:
+                    self._offsets = _value_offsets(self._payload)
+                # columns added by ALTER TABLE may not be in the record
+                if pos * 2 < len(self._offsets):
+                    c = varint_and_next_index(self._payload, self._offsets[pos * 2])[0]
+                    v = _decode_value(self._payload, c, self._offsets[pos * 2 + 1])
+                else:
+                    v = None
+            self._values[i] = v
+        return v
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def get(self, name, default=None):
+        return self[name] if name in self._columns[2] else default
+
+    def keys(self):
+        return list(self._columns[0])
+
+    def values(self):
+        return [self[name] for name in self._columns[0]]
+
+    def items(self):
+        return [(name, self[name]) for name in self._columns[0]]
+
+    def __iter__(self):
+        return iter(self._columns[0])
+
+    def __len__(self):
+        return len(self._columns[0])
+
+    def __contains__(self, name):
+        return name in self._columns[2]
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            other = dict(other.items())
+        return dict(self.items()) == other
+
+    def __repr__(self):
+        return "Row({})".format(dict(self.items()))
+
+
 def _encoder(v):
     if v is None:
         return 0, b''
@@ -108,20 +264,11 @@ def _encoder(v):
             return 8, b''
         elif v == 1:
             return 9, b''
-        elif v == (v & 0xff):
-            return 1, bytes([v])
-        elif v == (v & 0xffff):
-            return 2, v.to_bytes(2, "big")
-        elif v == (v & 0xffffff):
-            return 3, v.to_bytes(3, "big")
-        elif v == (v & 0xffffffff):
-            return 4, v.to_bytes(4, "big")
-        elif v == (v & 0xffffffffff):
-            return 5, v.to_bytes(6, "big")
-        elif v == (v & 0xffffffffffff):
-            return 6, v.to_bytes(8, "big")
-        else:
-            raise ValueError("interger value overflow:{}".format(v))
+        for t in range(1, 7):
+            ln = _SERIAL_TYPE_SIZES[t]
+            if -(1 << (ln * 8 - 1)) <= v < (1 << (ln * 8 - 1)):
+                return t, (v & ((1 << (ln * 8)) - 1)).to_bytes(ln, "big")
+        raise ValueError("interger value overflow:{}".format(v))
     elif isinstance(v, float):
         return 7, struct.pack(">d", v)
     elif isinstance(v, (bytes, bytearray)):
@@ -141,4 +288,8 @@ def pack_value_list(value_list):
         t, v = _encoder(value)
         header += to_varint(t)
         values += v
-    return to_varint(len(header) + 1) + header + values
+    # header size includes the varint of itself
+    n = len(header) + 1
+    while len(to_varint(n)) + len(header) != n:
+        n = len(to_varint(n)) + len(header)
+    return to_varint(n) + header + values
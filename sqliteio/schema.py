@@ -22,6 +22,8 @@
 # SOFTWARE.
 ################################################################################
 import re
+from collections import namedtuple
+from .record import Row
 
 
 # https://www.sqlite.org/lang_createtable.html
@@ -113,6 +115,17 @@ def _parse_parentheses(tokens, start):
     return values, i + 1
 
 
+def _namedtuple(names):
+    """namedtuple class of column names.
+    Names which are not valid field names (_id, from, ...) are renamed to _<position>.
+    """
+    try:
+        return namedtuple("Record", names, rename=True)
+    except TypeError:
+        # MicroPython namedtuple has no rename
+        return namedtuple("Record", names)
+
+
 class TableColumn:
     def __init__(self, pos, name, tokens, start):
         self.pos = pos
@@ -229,6 +242,7 @@ class TableSchema(BaseSchema):
         self.foreign_key_constraints = []   # list[(list[str], str, list[str])]
         self.check_constraints = []         # list[str]
         self.unique_key_constraints = []    # list[list[str]]
+        self._namedtuples = {}              # tuple of column names -> namedtuple class
 
         definitions = self._split_definitions()
         for d in definitions:
@@ -335,6 +349,87 @@ class TableSchema(BaseSchema):
             for r, c in zip(record, self.columns)
         })
 
+    def _columns_by_names(self, column_names):
+        if column_names is None:
+            return self.columns
+        columns = []
+        for name in column_names:
+            column = self.get_column_by_name(name)
+            if column is None:
+                raise ValueError("column {} is not in {}".format(name, self.table_name))
+            columns.append(column)
+        return columns
+
+    def projection(self, column_names):
+        """(record positions, converter) to fetch column_names only.
+        positions is None if column_names is None (all columns)
+        """
+        if column_names is None:
+            return None, self.row_converter
+        columns = self._columns_by_names(column_names)
+        positions = set([c.pos for c in columns if not c.is_rowid])
+
+        def converter(rowid, record):
+            return (rowid, {
+                c.name: rowid if c.is_rowid else (record[c.pos] if c.pos < len(record) else None)
+                for c in columns
+            })
+        return positions, converter
+
+    def tuple_projection(self, column_names, named=False):
+        """(record positions, converter) to make tuple of column_names values in the order.
+        If named is True, namedtuple is made.
+        positions is None if column_names is None (all columns)
+        """
+        columns = self._columns_by_names(column_names)
+        make = tuple
+        if named:
+            names = tuple([c.name for c in columns])
+            if names not in self._namedtuples:
+                self._namedtuples[names] = _namedtuple(names)
+            record_class = self._namedtuples[names]
+
+            def make(values):
+                return record_class(*values)
+
+        if column_names is None:
+            # record is in column order, only rowid is substituted
+            n = len(columns)
+            rowid_pos = None
+            for c in columns:
+                if c.is_rowid:
+                    rowid_pos = c.pos
+
+            def converter(rowid, record):
+                if len(record) < n:
+                    record.extend([None] * (n - len(record)))
+                if rowid_pos is not None:
+                    record[rowid_pos] = rowid
+                return (rowid, make(record))
+            return None, converter
+
+        def converter(rowid, record):
+            return (rowid, make([
+                rowid if c.is_rowid else (record[c.pos] if c.pos < len(record) else None)
+                for c in columns
+            ]))
+        return set([c.pos for c in columns if not c.is_rowid]), converter
+
+    def row_projection(self, column_names):
+        """(record positions, converter) to make Row of column_names from payload bytes.
+        positions is None if column_names is None (all columns)
+        """
+        columns = self._columns_by_names(column_names)
+        names = [c.name for c in columns]
+        record_positions = [None if c.is_rowid else c.pos for c in columns]
+        row_columns = (names, record_positions, {name: i for i, name in enumerate(names)})
+
+        def converter(rowid, payload):
+            return (rowid, Row(row_columns, rowid, payload))
+        if column_names is None:
+            return None, converter
+        return set([pos for pos in record_positions if pos is not None]), converter
+
     @property
     def column_names(self):
         return [c.name for c in self.columns]
@@ -0,0 +1,297 @@
+################################################################################
+# MIT License
+#
+# Copyright (c) 2023, 2024 Hajime Nakagami<nakagami@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+################################################################################
+# Storage backends under Pager.
+import io
+import os
+import errno
+import time
+try:
+    import mmap
+except ImportError:
+    mmap = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+__all__ = ("BaseVFS", "FileVFS", "MmapVFS", "MemoryVFS", "BusyError", "get_vfs")
+
+# max number of pages written by one system call
+IOV_MAX = 1024
+
+# lock bytes same as SQLite (os_unix.c)
+PENDING_BYTE = 0x40000000
+RESERVED_BYTE = PENDING_BYTE + 1
+SHARED_FIRST = PENDING_BYTE + 2
+SHARED_SIZE = 510
+
+# seconds to retry a lock held by another connection
+DEFAULT_BUSY_TIMEOUT = 5.0
+BUSY_RETRY_INTERVAL = 0.01
+
+
+class BusyError(OSError):
+    "database file is locked by another connection"
+
+
+class BaseVFS:
+    """storage interface
+    name is file path used for journal and WAL, or None.
+    persistent storage without name can't be written with rollback journal.
+    page_size is set by Pager after reading database header.
+    """
+    name = None
+    persistent = True
+    page_size = None
+
+    def read(self, offset, size):
+        raise NotImplementedError()
+
+    def write(self, offset, data):
+        raise NotImplementedError()
+
+    def read_page(self, pgno):
+        return self.read((pgno - 1) * self.page_size, self.page_size)
+
+    def write_pages(self, pages):
+        "write (pgno, data) list sorted by pgno"
+        for pgno, data in pages:
+            self.write((pgno - 1) * self.page_size, data)
+
+    def size(self):
+        raise NotImplementedError()
+
+    def truncate(self, size):
+        raise NotImplementedError()
+
+    def writable(self):
+        return True
+
+    def sync(self):
+        pass
+
+    def lock(self, exclusive=False):
+        pass
+
+    def unlock(self):
+        pass
+
+    def check_reserved_lock(self):
+        "True if another connection holds RESERVED lock"
+        return False
+
+    def close(self):
+        pass
+
+
+class FileVFS(BaseVFS):
+    """file object storage
+    Locks are compatible with SQLite, but reads don't take SHARED lock.
+    So don't read the database while another process is writing it.
+    """
+    busy_timeout = DEFAULT_BUSY_TIMEOUT
+
+    def __init__(self, fileobj, name=None):
+        "name is file path of fileobj. If it is None, fileobj.name is used if exists"
+        self.fileobj = fileobj
+        if name is None:
+            name = getattr(fileobj, "name", None)
+        self.name = name if isinstance(name, str) else None
+        self.persistent = not isinstance(fileobj, io.BytesIO)
+        self.fileno = None
+        try:
+            self.fileno = fileobj.fileno()
+        except (AttributeError, OSError):
+            pass
+
+    def writable(self):
+        return getattr(self.fileobj, "writable", lambda: True)()
+
+    def read(self, offset, size):
+        if self.fileno is not None and hasattr(os, "pread"):
+            # positional read without sharing file offset
+            return os.pread(self.fileno, size, offset)
+        self.fileobj.seek(offset, 0)
+        return self.fileobj.read(size)
+
+    def _write_run(self, offset, buffers):
+        "write contiguous buffers at once"
+        if self.fileno is not None and hasattr(os, "pwritev"):
+            written = os.pwritev(self.fileno, buffers, offset)
+            if written < sum([len(b) for b in buffers]):
+                data = b''.join(buffers)
+                while written < len(data):
+                    written += os.pwrite(self.fileno, data[written:], offset + written)
+        else:
+            self.fileobj.seek(offset, 0)
+            self.fileobj.write(b''.join(buffers))
+
+    def write(self, offset, data):
+        self.fileobj.flush()
+        self._write_run(offset, [data])
+        self.fileobj.flush()
+
+    def write_pages(self, pages):
+        # merge runs of adjacent pages into one write
+        runs = []
+        for pgno, data in pages:
+            if runs and runs[-1][0] + len(runs[-1][1]) == pgno and len(runs[-1][1]) < IOV_MAX:
+                runs[-1][1].append(data)
+            else:
+                runs.append((pgno, [data]))
+        # buffered data must be written before positional write
+        self.fileobj.flush()
+        for pgno, buffers in runs:
+            self._write_run((pgno - 1) * self.page_size, buffers)
+        self.fileobj.flush()
+
+    def size(self):
+        self.fileobj.seek(0, 2)
+        return self.fileobj.tell()
+
+    def truncate(self, size):
+        self.fileobj.flush()
+        self.fileobj.truncate(size)
+
+    def sync(self):
+        self.fileobj.flush()
+        if self.fileno is not None and hasattr(os, "fsync"):
+            os.fsync(self.fileno)
+
+    def lock(self, exclusive=False):
+        """take SHARED or EXCLUSIVE lock without blocking.
+        Retry for busy_timeout seconds and raise BusyError while another connection holds a conflicting lock.
+        """
+        if fcntl is None or self.fileno is None:
+            return
+        cmd = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB
+        waited = 0.0
+        while True:
+            try:
+                fcntl.lockf(self.fileno, cmd, SHARED_SIZE, SHARED_FIRST, os.SEEK_SET)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                if waited >= self.busy_timeout:
+                    raise BusyError(e.errno, "database is locked")
+            time.sleep(BUSY_RETRY_INTERVAL)
+            waited += BUSY_RETRY_INTERVAL
+
+    def unlock(self):
+        if fcntl is not None and self.fileno is not None:
+            fcntl.lockf(self.fileno, fcntl.LOCK_UN, SHARED_SIZE, SHARED_FIRST, os.SEEK_SET)
+
+    def check_reserved_lock(self):
+        "same as unixCheckReservedLock() in sqlite3"
+        if fcntl is None or self.fileno is None:
+            return False
+        try:
+            fcntl.lockf(self.fileno, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, RESERVED_BYTE, os.SEEK_SET)
+        except OSError:
+            return True
+        fcntl.lockf(self.fileno, fcntl.LOCK_UN, 1, RESERVED_BYTE, os.SEEK_SET)
+        return False
+
+    def close(self):
+        self.fileno = None
+        self.fileobj.close()
+
+
+class MmapVFS(FileVFS):
+    "read from memory mapped file, write to file"
+    def __init__(self, fileobj, name=None):
+        super().__init__(fileobj, name)
+        if mmap is None:
+            raise ValueError("mmap is not supported")
+        if self.fileno is None:
+            raise ValueError("mmap needs real file")
+        self._map()
+
+    def _map(self):
+        # old mapping is released when exported memoryviews are released
+        self.mmap = memoryview(mmap.mmap(self.fileno, 0, access=mmap.ACCESS_READ))
+
+    def read(self, offset, size):
+        if offset + size > len(self.mmap) and offset + size <= self.size():
+            # file has grown
+            self._map()
+        if offset + size <= len(self.mmap):
+            return self.mmap[offset:offset + size]
+        return super().read(offset, size)
+
+    def truncate(self, size):
+        super().truncate(size)
+        self._map()
+
+    def close(self):
+        self.mmap = None
+        super().close()
+
+
+class MemoryVFS(BaseVFS):
+    "in memory storage. fileobj is read at open and never written"
+    persistent = False
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        if isinstance(fileobj, (bytes, bytearray)):
+            self.data = bytearray(fileobj)
+        else:
+            fileobj.seek(0, 0)
+            self.data = bytearray(fileobj.read())
+
+    def read(self, offset, size):
+        return self.data[offset:offset + size]
+
+    def write(self, offset, data):
+        if len(self.data) < offset:
+            self.data += b'\x00' * (offset - len(self.data))
+        self.data[offset:offset + len(data)] = data
+
+    def size(self):
+        return len(self.data)
+
+    def truncate(self, size):
+        del self.data[size:]
+
+    def close(self):
+        if hasattr(self.fileobj, "close"):
+            self.fileobj.close()
+
+
+def get_vfs(fileobj, vfs, name=None):
+    """get storage backend by name or BaseVFS instance
+    name is file path of fileobj.
+    """
+    if isinstance(vfs, BaseVFS):
+        return vfs
+    if vfs == "file":
+        return FileVFS(fileobj, name)
+    elif vfs == "mmap":
+        return MmapVFS(fileobj, name)
+    elif vfs == "memory":
+        return MemoryVFS(fileobj)
+    raise ValueError("Invalid vfs: {}".format(vfs))
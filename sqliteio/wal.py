@@ -0,0 +1,199 @@
+################################################################################
+# MIT License
+#
+# Copyright (c) 2023, 2024 Hajime Nakagami<nakagami@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+################################################################################
+# https://www.sqlite.org/fileformat2.html#the_write_ahead_log
+# The wal-index (-shm file) is not used.
+import struct
+from .journal import fsync, _nonce
+
+
+__all__ = ("WriteAheadLog", )
+
+WAL_MAGIC_LE = 0x377f0682
+WAL_MAGIC_BE = 0x377f0683
+WAL_FORMAT_VERSION = 3007000
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+
+
+def wal_checksum(data, s0, s1, big_endian):
+    "cumulative checksum of data"
+    n = len(data) // 4
+    values = struct.unpack("{}{}I".format(">" if big_endian else "<", n), data)
+    for i in range(0, n, 2):
+        s0 = (s0 + values[i] + s1) & 0xffffffff
+        s1 = (s1 + values[i+1] + s0) & 0xffffffff
+    return s0, s1
+
+
+class WriteAheadLog:
+    def __init__(self, path, page_size):
+        self.path = path
+        self.page_size = page_size
+        self.fileobj = None
+        self.writable = False
+        self.checkpoint_seq = 0
+        self._reset()
+
+    def _reset(self):
+        self.frames = {}        # pgno -> offset of the latest committed frame
+        self.db_size = 0        # database size in pages of the last commit
+        self.header = None
+        self.big_endian = False
+        self.salt = None
+        self.checksum = (0, 0)
+        self.next_offset = WAL_HEADER_SIZE
+
+    def _open(self, write=False):
+        if self.fileobj is not None and write and not self.writable:
+            self.close()
+        if self.fileobj is None:
+            self.writable = write
+            # unbuffered, other connections may rewrite the WAL file
+            try:
+                self.fileobj = open(self.path, "rb+" if write else "rb", buffering=0)
+            except OSError:
+                if not write:
+                    return False
+                self.fileobj = open(self.path, "wb+", buffering=0)
+        return True
+
+    def _read(self, offset, size):
+        self.fileobj.seek(offset, 0)
+        return self.fileobj.read(size)
+
+    def load(self):
+        """read committed frames.
+        Frames after the last loaded frame are read if the WAL header is not changed.
+        """
+        if not self._open():
+            self._reset()
+            return
+        header = self._read(0, WAL_HEADER_SIZE)
+        if header != self.header:
+            self._reset()
+            if len(header) < WAL_HEADER_SIZE:
+                return
+            magic, version, page_size, checkpoint_seq, salt1, salt2, c0, c1 = struct.unpack(">8I", header)
+            if magic not in (WAL_MAGIC_LE, WAL_MAGIC_BE) or page_size != self.page_size:
+                return
+            big_endian = magic == WAL_MAGIC_BE
+            if wal_checksum(header[:24], 0, 0, big_endian) != (c0, c1):
+                return
+            self.header = header
+            self.checkpoint_seq = checkpoint_seq
+            self.big_endian = big_endian
+            self.salt = header[16:24]
+            self.checksum = (c0, c1)
+
+        frame_size = WAL_FRAME_HEADER_SIZE + self.page_size
+        offset = self.next_offset
+        checksum = self.checksum
+        pending = {}
+        while True:
+            frame = self._read(offset, frame_size)
+            if len(frame) < frame_size or frame[8:16] != self.salt:
+                break
+            checksum = wal_checksum(frame[:8], checksum[0], checksum[1], self.big_endian)
+            checksum = wal_checksum(frame[WAL_FRAME_HEADER_SIZE:], checksum[0], checksum[1], self.big_endian)
+            if checksum != struct.unpack(">II", frame[16:24]):
+                break
+            pgno, commit_size = struct.unpack(">II", frame[:8])
+            pending[pgno] = offset + WAL_FRAME_HEADER_SIZE
+            offset += frame_size
+            if commit_size:
+                self.frames.update(pending)
+                pending = {}
+                self.db_size = commit_size
+                self.next_offset = offset
+                self.checksum = checksum
+
+    def _write_header(self):
+        "start new WAL file"
+        header = struct.pack(
+            ">6I", WAL_MAGIC_LE, WAL_FORMAT_VERSION, self.page_size, self.checkpoint_seq, _nonce(), _nonce()
+        )
+        self.checksum = wal_checksum(header, 0, 0, False)
+        self.header = header + struct.pack(">II", *self.checksum)
+        self.big_endian = False
+        self.salt = self.header[16:24]
+        self.fileobj.seek(0, 0)
+        self.fileobj.write(self.header)
+        self.fileobj.truncate(WAL_HEADER_SIZE)
+        self.next_offset = WAL_HEADER_SIZE
+
+    def append(self, pages, db_size):
+        """append (pgno, data) list as frames and commit.
+        db_size is database size in pages after commit.
+        """
+        self._open(write=True)
+        if self.header is None:
+            self._write_header()
+        buf = bytearray()
+        s0, s1 = self.checksum
+        offset = self.next_offset
+        frames = {}
+        for i, (pgno, data) in enumerate(pages):
+            frame_header = struct.pack(">II", pgno, db_size if i == len(pages) - 1 else 0)
+            s0, s1 = wal_checksum(frame_header, s0, s1, self.big_endian)
+            s0, s1 = wal_checksum(data, s0, s1, self.big_endian)
+            buf += frame_header + self.salt + struct.pack(">II", s0, s1)
+            buf += data
+            frames[pgno] = offset + len(buf) - self.page_size
+        self.fileobj.seek(offset, 0)
+        self.fileobj.write(buf)
+        fsync(self.fileobj)
+
+        self.frames.update(frames)
+        self.db_size = db_size
+        self.next_offset = offset + len(buf)
+        self.checksum = (s0, s1)
+
+    def restart(self):
+        "discard all frames after checkpoint"
+        self._open(write=True)
+        self._reset()
+        self.checkpoint_seq += 1
+        self.fileobj.truncate(0)
+        fsync(self.fileobj)
+
+    def read_page(self, pgno):
+        """read page data from the latest frame. Returns None if not in WAL
+        Frames are reloaded if the WAL was restarted by another connection.
+        """
+        offset = self.frames.get(pgno)
+        if offset is None:
+            return None
+        frame = self._read(offset - WAL_FRAME_HEADER_SIZE, WAL_FRAME_HEADER_SIZE + self.page_size)
+        if len(frame) < WAL_FRAME_HEADER_SIZE + self.page_size or frame[8:16] != self.salt:
+            self.load()
+            offset = self.frames.get(pgno)
+            if offset is None:
+                return None
+            frame = self._read(offset - WAL_FRAME_HEADER_SIZE, WAL_FRAME_HEADER_SIZE + self.page_size)
+        return frame[WAL_FRAME_HEADER_SIZE:]
+
+    def close(self):
+        if self.fileobj is not None:
+            self.fileobj.close()
+            self.fileobj = None
@@ -976,6 +976,46 @@ def create_pk_fk_table():
     conn.close()
 
 
+def create_wal_table():
+    f = "wal.sqlite"
+    for path in (f, f + "-wal", "wal_orig.sqlite"):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    conn = sqlite3.connect("wal_orig.sqlite")
+    cur = conn.cursor()
+    cur.execute("pragma page_size=512")
+    cur.execute("pragma journal_mode=WAL")
+    cur.execute("pragma wal_autocheckpoint=0")
+    cur.execute("""
+        CREATE TABLE many_record_table(
+            a integer PRIMARY KEY not null,
+            b integer,
+            c varchar(255)
+        )""")
+    cur.execute("CREATE INDEX many_record_idx_c ON many_record_table(c)")
+    for i in range(1, 334):
+        cur.execute("INSERT INTO many_record_table (b, c) values (?, 'aaaaaaaaaaaaaaaaaaaaaaaaaa')", [i])
+    conn.commit()
+    cur.execute("pragma wal_checkpoint(TRUNCATE)")
+
+    # recent commits are only in wal file
+    for i in range(334, 667):
+        cur.execute("INSERT INTO many_record_table (b, c) values (?, 'abcdefghijklmnopqrstuvwxyz')", [i])
+    conn.commit()
+    cur.execute("DELETE FROM many_record_table WHERE a < 11")
+    conn.commit()
+
+    # copy database and wal file before checkpoint on close
+    for src, dst in (("wal_orig.sqlite", f), ("wal_orig.sqlite-wal", f + "-wal")):
+        with open(src, "rb") as f1:
+            with open(dst, "wb") as f2:
+                f2.write(f1.read())
+    conn.close()
+    os.remove("wal_orig.sqlite")
+
+
 if __name__ == "__main__":
     create_test_table()
     create_test0_table()
@@ -1035,3 +1075,4 @@ if __name__ == "__main__":
     create_multi_pk_many_record_table()
 
     create_pk_fk_table()
+    create_wal_table()
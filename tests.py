@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 import io
+import os
 import unittest
 import binascii
 
 import sqliteio
 from sqliteio import record
+from sqliteio import schema
 
 
 class TestRecord(unittest.TestCase):
@@ -24,6 +26,24 @@ class TestRecord(unittest.TestCase):
             bytearray(binascii.unhexlify("040009416161616161616161616161616161616161616161616161616161"))
         )
 
+    def test_signed_integer(self):
+        # same serial types and bytes as SQLite
+        self.assertEqual(record.pack_value_list([200]), bytearray(binascii.unhexlify("020200c8")))
+        self.assertEqual(record.pack_value_list([-1]), bytearray(binascii.unhexlify("0201ff")))
+        self.assertEqual(record.pack_value_list([-32769]), bytearray(binascii.unhexlify("0203ff7fff")))
+        values = [127, 128, -128, -129, 32767, 32768, -2**31, 2**40, -2**47, 2**63-1, -2**63]
+        self.assertEqual(record.decode_payload(record.pack_value_list(values)), values)
+        with self.assertRaises(ValueError):
+            record.pack_value_list([2**63])
+
+    def test_wide_record(self):
+        # header size varint is 2 bytes
+        values = ['x', 300, 1.5] * 50
+        b = record.pack_value_list(values)
+        self.assertEqual(b[:2], bytearray(binascii.unhexlify("8118")))
+        self.assertEqual(record.decode_payload(b), values)
+        self.assertEqual(record.decode_payload(memoryview(b)), values)
+
     def test_dict_to_value_list(self):
         test = sqliteio.open("testdata/test.sqlite")
         table_schema = test.tables.get("test_table")
@@ -59,15 +79,17 @@ class TestRecord(unittest.TestCase):
         test.close()
 
 
-class TestPager(unittest.TestCase):
-    def test_header(self):
-        database = sqliteio.open("testdata/test.sqlite")
-        database.pager.pgno_first_freelist_trunk = 2
-        self.assertEqual(database.pager.pgno_first_freelist_trunk, 2)
-        database.close()
+class TestBase(unittest.TestCase):
+    def _copy(self, src, dst):
+        with open(src, "rb") as f1:
+            with open(dst, "wb") as f2:
+                f2.write(f1.read())
 
+    def _open_bytesio(self, path, **kwargs):
+        "open a copy of the database file in memory"
+        with open(path, "rb") as f:
+            return sqliteio.open(io.BytesIO(f.read()), **kwargs)
 
-class TestBase(unittest.TestCase):
     def assertEqualDB(self, database1, database2):
         self.assertEqual(database1.pager.max_pgno, database1.pager.max_pgno)
         for i in range(2, database1.pager.max_pgno+1):
@@ -89,44 +111,186 @@ class TestBase(unittest.TestCase):
                 self.assertEqual(page1.data, page2.data)
 
 
+class TestPager(TestBase):
+    def test_header(self):
+        database = sqliteio.open("testdata/test.sqlite")
+        database.pager.pgno_first_freelist_trunk = 2
+        self.assertEqual(database.pager.pgno_first_freelist_trunk, 2)
+        database.close()
+
+    def test_database_header(self):
+        database = self._open_bytesio("testdata/many_record_empty.sqlite")
+        header = database.pager.header
+        self.assertEqual(header.page_size, database.pager.page_size)
+        self.assertEqual(database.pager.text_encoding, "utf-8")
+        self.assertEqual(database.pager.user_version, 0)
+        self.assertEqual(database.pager.reserved_space, 0)
+        change_counter = database.pager.file_change_counter
+        schema_cookie = database.pager.schema_cookie
+
+        for i in range(1, 334):
+            database.insert("many_record_table", [{'a': None, 'b': i, 'c': 'aaaaaaaaaaaaaaaaaaaaaaaaaa'}])
+        database.pager.user_version = 123
+        database.commit()
+        self.assertEqual(database.pager.header, header)
+        self.assertEqual(database.pager.file_change_counter, change_counter + 1)
+        self.assertEqual(database.pager.header_btree_count, database.pager.max_pgno)
+
+        database.fileobj.seek(0, 0)
+        data = database.fileobj.read()
+        self.assertEqual(int.from_bytes(data[24:28], "big"), change_counter + 1)
+        self.assertEqual(int.from_bytes(data[28:32], "big"), len(data) // database.pager.page_size)
+        self.assertEqual(int.from_bytes(data[40:44], "big"), schema_cookie)
+        self.assertEqual(int.from_bytes(data[60:64], "big"), 123)
+        self.assertEqual(int.from_bytes(data[92:96], "big"), change_counter + 1)
+        database.close()
+
+    def test_cache(self):
+        database = sqliteio.open("testdata/many_record.sqlite", cache_size=2)
+        pager = database.pager
+        self.assertEqual(pager.cache_size, 2)
+        self.assertTrue(pager.get_page(3) is pager.get_page(3))
+        pager.get_page(4)
+        pager.get_page(5)
+        self.assertEqual(list(pager.cache.keys()), [4, 5])
+
+        # dirty pages are pinned until flush or rollback
+        page = pager.get_page(4)
+        page.is_dirty = True
+        pager.get_page(6)
+        pager.get_page(7)
+        self.assertTrue(pager.get_page(4) is page)
+        self.assertEqual(list(pager.cache.keys()), [6, 7])
+        database.rollback()
+        self.assertEqual(len(pager.pages), 0)
+        self.assertEqual(len(pager.cache), 0)
+        database.close()
+
+        database = sqliteio.open("testdata/many_record.sqlite", cache_size=-4)
+        self.assertEqual(database.pager.cache_size, 4096 // database.pager.page_size)
+        database.close()
+
+    def test_pread(self):
+        database = sqliteio.open("testdata/many_record.sqlite", cache_size=0)
+        if hasattr(os, "pread"):
+            self.assertTrue(database.pager.vfs.fileno is not None)
+            # positional read does not move file offset
+            database.fileobj.seek(0, 0)
+            database.pager.get_page(3)
+            self.assertEqual(database.fileobj.tell(), 0)
+        self.assertEqual(len(list(database.fetch_all("many_record_table"))), 999)
+        database.close()
+
+        database = self._open_bytesio("testdata/many_record.sqlite", cache_size=0)
+        self.assertEqual(database.pager.vfs.fileno, None)
+        self.assertEqual(len(list(database.fetch_all("many_record_table"))), 999)
+        database.close()
+
+    def test_flush(self):
+        database = self._open_bytesio("testdata/many_record_empty.sqlite")
+        writes = []
+        write_run = database.pager.vfs._write_run
+        database.pager.vfs._write_run = lambda offset, buffers: writes.append((offset, len(buffers))) or write_run(offset, buffers)
+        for i in range(1, 334):
+            database.insert("many_record_table", [{'a': None, 'b': i, 'c': 'aaaaaaaaaaaaaaaaaaaaaaaaaa'}])
+        # page 1 is written for the file change counter
+        dirty = sorted(set(database.pager.pages.keys()) | {1})
+        database.commit()
+
+        # sorted and coalesced
+        self.assertEqual([offset for offset, _ in writes], sorted([offset for offset, _ in writes]))
+        self.assertTrue(len(writes) < len(dirty))
+        self.assertEqual(sum([n for _, n in writes]), len(dirty))
+
+        database.fileobj.seek(0, 0)
+        database2 = sqliteio.open(io.BytesIO(database.fileobj.read()))
+        self.assertEqual(
+            [r["b"] for _, r in database2.fetch_all("many_record_table")],
+            list(range(1, 334))
+        )
+        database2.close()
+        database.close()
+
+    def test_stats(self):
+        database = self._open_bytesio("testdata/many_record.sqlite")
+        stats = database.stats()
+        list(database.fetch_all("many_record_table"))
+        self.assertTrue(stats.page_reads > 0)
+        self.assertEqual(stats.page_reads, stats.cache_misses)
+        self.assertEqual(stats.bytes_read, stats.page_reads * database.pager.page_size)
+        self.assertTrue(stats.by_type("page_reads")["TableLeafNode"] > 0)
+        self.assertTrue(stats.by_type("node_parses")["TableInteriorNode"] > 0)
+        self.assertEqual(stats.pages_written, 0)
+
+        stats.reset()
+        list(database.fetch_all("many_record_table"))
+        self.assertEqual(stats.page_reads, 0)
+        self.assertTrue(stats.cache_hits > 0)
+
+        stats.reset()
+        database.delete_by_rowid("many_record_table", 1)
+        database.commit()
+        self.assertTrue(stats.by_type("pages_written")["TableLeafNode"] > 0)
+        self.assertEqual(stats.bytes_written, stats.pages_written * database.pager.page_size)
+        database.close()
+
+        database = sqliteio.open("testdata/large_row.sqlite")
+        list(database.fetch_all("test_table"))
+        self.assertTrue(database.stats().by_type("overflow_pages")["TableLeafNode"] > 0)
+        database.close()
+
+
 class TestNode(TestBase):
     def test_split_table_leaf(self):
         database = sqliteio.open("testdata/test.sqlite")
 
         # split leaf table node
         table_schema = database.tables.get("test_table")
-        ancestors, leaf, cell_index, found = database.pager.find_rowid_table_path(table_schema.pgno, 1)
+        path = database.pager.cursor(table_schema.pgno).descend(1)
+        leaf, cell_index = path[-1]
         self.assertEqual(cell_index, 0)
-        self.assertEqual(found, True)
         self.assertEqual(leaf.number_of_cells, 2)
-
-        new_node = leaf.split_by_index(cell_index)
-        self.assertEqual(leaf.number_of_cells, 0)
-        self.assertEqual(new_node.number_of_cells, 2)
+        self.assertEqual(path[0][0].number_of_cells, 1)
+
+        r = database.get_by_rowid("test_table", 1)[1]
+        r.update({'a': 0, 'w': b'z' * 300})
+        rowid, value_list = table_schema.dict_to_value_list(r)
+        leaf.insert_and_balance(path[:-1], cell_index, leaf.to_cell_block(rowid, value_list))
+        path = database.pager.cursor(table_schema.pgno).descend(0)
+        self.assertEqual(path[0][0].pgno, table_schema.pgno)
+        self.assertEqual(path[0][0].number_of_cells, 2)
+        self.assertEqual([r[0] for r in database.fetch_all("test_table")], [0, 1, 2, 3, 4])
+        self.assertEqual(database.get_by_rowid("test_table", 0)[1]['w'], b'z' * 300)
 
         database.rollback()
-        ancestors, leaf, cell_index, found = database.pager.find_rowid_table_path(table_schema.pgno, 1)
-
-        new_node = leaf.split_by_index(1)
-        self.assertEqual(leaf.number_of_cells, 1)
-        self.assertEqual(new_node.number_of_cells, 1)
-
+        self.assertEqual([r[0] for r in database.fetch_all("test_table")], [1, 2, 3, 4])
         database.close()
 
-    def test_split_index_leaf(self):
+    def test_lazy_cells(self):
         database = sqliteio.open("testdata/many_record15.sqlite")
         index_leaf = database.pager.get_page(4).get_node()
+        self.assertEqual(index_leaf.cells._memo, {})
+        self.assertEqual(len(index_leaf.cells), 15)
+        cell = index_leaf.cells[-1]
+        self.assertEqual(len(index_leaf.cells._memo), 1)
+        self.assertTrue(index_leaf.cells[14] is cell)
+        self.assertEqual(list(index_leaf.cells)[-1].cell_block, cell.cell_block)
+        self.assertEqual(len(index_leaf.cells[:3]), 3)
+        database.close()
 
-        self.assertEqual(index_leaf.number_of_cells, 15)
-
-        new_leaf, interior_cell_block = index_leaf.split_by_median()
-
-        self.assertEqual(index_leaf.number_of_cells, 8)
-        self.assertEqual(new_leaf.number_of_cells, 6)
-        self.assertEqual(
-            binascii.hexlify(interior_cell_block).decode('ascii'),
-            "1e034101616161616161616161616161616161616161616161616161616109"
-        )
+    def test_node_cache(self):
+        database = sqliteio.open("testdata/many_record15.sqlite")
+        database.stats().reset()
+        page = database.pager.get_page(4)
+        node = page.get_node()
+        self.assertTrue(page.get_node() is node)
+        self.assertEqual(database.stats().node_parses, 1)
+        node.delete(0)
+        node2 = page.get_node()
+        self.assertFalse(node2 is node)
+        self.assertEqual(node2.number_of_cells, 14)
+        database.rollback()
+        self.assertEqual(database.pager.get_page(4).get_node().number_of_cells, 15)
         database.close()
 
     def test_find_rowid_index_path(self):
@@ -157,6 +321,113 @@ class TestNode(TestBase):
         self.assertEqual(found, False)
         database.close()
 
+    def test_find_cell_index(self):
+        database = sqliteio.open("testdata/many_record333.sqlite")
+        table_schema = database.table_schema("many_record_table")
+        path = database.pager.cursor(table_schema.pgno).descend(100)
+        interior, leaf = path[0][0], path[-1][0]
+        rowids = [leaf._rowid_at(leaf.page.data, leaf._cell_pointer(i)) for i in range(leaf.number_of_cells)]
+        self.assertEqual(rowids, list(range(99, 113)))
+        for rowid in range(97, 115):
+            self.assertEqual(leaf.find_cell_index(rowid), len([r for r in rowids if r < rowid]))
+
+        keys = [interior._key_at(interior.page.data, interior._cell_pointer(i)) for i in range(interior.number_of_cells)]
+        for rowid in range(0, 335):
+            self.assertEqual(interior._bisect_left(interior._key_at, rowid), len([k for k in keys if k < rowid]))
+            leaf = database.pager.cursor(table_schema.pgno).descend(rowid)[-1][0]
+            rowids = [leaf._rowid_at(leaf.page.data, leaf._cell_pointer(i)) for i in range(leaf.number_of_cells)]
+            if 1 <= rowid <= 333:
+                self.assertTrue(rowid in rowids)
+        database.close()
+
+
+class TestCursor(TestBase):
+    def test_table_cursor(self):
+        database = sqliteio.open("testdata/many_record.sqlite")
+        table_schema = database.table_schema("many_record_table")
+        cursor = database.pager.cursor(table_schema.pgno)
+
+        rowids = []
+        valid = cursor.first()
+        while valid:
+            rowids.append(cursor.rowid)
+            valid = cursor.next()
+        self.assertEqual(rowids, list(range(1, 1000)))
+        self.assertFalse(cursor.is_valid)
+
+        rowids = []
+        valid = cursor.last()
+        while valid:
+            rowids.append(cursor.rowid)
+            valid = cursor.prev()
+        self.assertEqual(rowids, list(range(999, 0, -1)))
+
+        self.assertTrue(cursor.seek(500))
+        self.assertEqual(cursor.rowid, 500)
+        self.assertEqual(cursor.row(table_schema.row_converter), database.get_by_rowid("many_record_table", 500))
+        self.assertTrue(cursor.next())
+        self.assertEqual(cursor.rowid, 501)
+        self.assertTrue(cursor.prev())
+        self.assertTrue(cursor.prev())
+        self.assertEqual(cursor.rowid, 499)
+        self.assertFalse(cursor.seek(1000))
+        database.close()
+
+    def test_index_cursor(self):
+        database = sqliteio.open("testdata/many_record.sqlite")
+        index_schema = database.get_index_schema_by_name("many_record_idx_c")
+        cursor = database.pager.cursor(index_schema.pgno)
+
+        records = []
+        valid = cursor.first()
+        while valid:
+            records.append(cursor.record())
+            valid = cursor.next()
+        self.assertEqual(len(records), 999)
+        self.assertEqual(records, sorted(records))
+
+        reverse_records = []
+        valid = cursor.last()
+        while valid:
+            reverse_records.append(cursor.record())
+            valid = cursor.prev()
+        self.assertEqual(reverse_records, records[::-1])
+
+        # (c, rowid)
+        self.assertTrue(cursor.seek(records[300], index_schema.orders + [1]))
+        self.assertEqual(cursor.record(), records[300])
+        self.assertTrue(cursor.next())
+        self.assertEqual(cursor.record(), records[301])
+        database.close()
+
+    def test_reverse(self):
+        database = sqliteio.open("testdata/many_record.sqlite")
+        self.assertEqual(
+            [r[0] for r in database.fetch_all("many_record_table", reverse=True)],
+            list(range(999, 0, -1))
+        )
+        pgno = database.table_schema("many_record_table").pgno
+        self.assertEqual(
+            [r[0] for r in database.pager.rowid_range_records(pgno, 10, 20, reverse=True)],
+            list(range(20, 9, -1))
+        )
+        self.assertEqual(
+            [r[0] for r in database.pager.rowid_range_records(pgno, 990, 2000, reverse=True)],
+            list(range(999, 989, -1))
+        )
+        database.close()
+
+        database = sqliteio.open(None, vfs=sqliteio.FileVFS(open("testdata/wal.sqlite", "rb"), "testdata/wal.sqlite"))
+        index_schema = database.get_index_schema_by_name("many_record_idx_c")
+        key = ['abcdefghijklmnopqrstuvwxyz']
+        self.assertEqual(
+            [r[-1] for _, r in database.pager.index_range_records(
+                index_schema.pgno, key, key, index_schema.orders, [0], reverse=True
+            )],
+            list(range(666, 333, -1))
+        )
+        database.close()
+
 
 class TestBasic(TestBase):
 
@@ -801,6 +1072,76 @@ class TestBasic(TestBase):
             )
         database.close()
 
+    def test_columns(self):
+        database = sqliteio.open("testdata/test.sqlite")
+        self.assertEqual(
+            list(database.fetch_all("test_table", columns=["c", "a"])),
+            [(1, {'c': 1, 'a': 1}), (2, {'c': 2, 'a': 2}), (3, {'c': 3, 'a': 3}), (4, {'c': 4, 'a': 4})]
+        )
+        self.assertEqual(database.get_by_rowid("test_table", 2, columns=["b"]), (2, {'b': 'B'}))
+        self.assertEqual(database.get_by_pk("test_table", 3, columns=["z"]), (3, {'z': '1967-08-11 12:34:45'}))
+        # by index and by scan
+        self.assertEqual(list(database.filter("test_table", {"b": "C", "c": 3}, columns=["w"])), [(3, {'w': b'c' * 150})])
+        self.assertEqual(list(database.filter("test_table", {"c": 4}, columns=["b"])), [(4, {'b': 'D'})])
+        with self.assertRaises(ValueError):
+            database.get_by_rowid("test_table", 1, columns=["unknown"])
+        database.close()
+
+        # overflow pages are not read for columns before the large blob
+        database = sqliteio.open("testdata/large_row.sqlite")
+        self.assertEqual([r["c"] for _, r in database.fetch_all("test_table", columns=["c", "d"])], [1, 2, 3])
+        self.assertEqual(database.stats().overflow_pages, 0)
+        self.assertEqual([len(r["w"]) for _, r in database.fetch_all("test_table", columns=["w"])], [500, 1000, 1500])
+        self.assertTrue(database.stats().overflow_pages > 0)
+        database.close()
+
+    def test_row_format(self):
+        database = sqliteio.open("testdata/test.sqlite", row_format="row")
+        rowid, r = database.get_by_rowid("test_table", 1)
+        self.assertTrue(isinstance(r, sqliteio.Row))
+        self.assertEqual(r._values, None)
+        self.assertEqual(r["b"], 'A')
+        self.assertEqual(r.w, b'a' * 150)
+        self.assertEqual(r.a, 1)
+        self.assertEqual(r.get("unknown", 0), 0)
+        with self.assertRaises(KeyError):
+            r["unknown"]
+        with self.assertRaises(AttributeError):
+            r.unknown
+        self.assertEqual(
+            dict(r),
+            {'a': 1, 'b': 'A', 'c': 1, 'd': 1.23, 'e': 1.23, 'w': b'a' * 150, 'x': '1967-08-11', 'y': '12:34:45', 'z': '1967-08-11 12:34:45'}
+        )
+        self.assertEqual(list(r.keys()), ["b", "c", "d", "e", "a", "w", "x", "y", "z"])
+        self.assertEqual(database.get_by_rowid("test_table", 4, columns=["c", "a"]), (4, {'c': 4, 'a': 4}))
+        self.assertEqual([r.b for _, r in database.filter("test_table", {"c": 2})], ['B'])
+        self.assertEqual([r.c for _, r in database.fetch_all("test_table", reverse=True)], [4, 3, 2, 1])
+        database.close()
+
+        with self.assertRaises(ValueError):
+            sqliteio.open("testdata/test.sqlite", row_format="unknown")
+
+        database = sqliteio.open("testdata/test.sqlite", row_format="tuple")
+        # rowid is substituted for INTEGER PRIMARY KEY column
+        self.assertEqual(
+            database.get_by_rowid("test_table", 4),
+            (4, ('D', 4, 1.23, 1.23, 4, b'd', '1967-08-11', '12:34:45', '1967-08-11 12:34:45'))
+        )
+        self.assertEqual([r for _, r in database.fetch_all("test_table", columns=["a", "b"])], [(1, 'A'), (2, 'B'), (3, 'C'), (4, 'D')])
+        self.assertEqual(list(database.filter("test_table", {"b": "B", "c": 2}, columns=["c"])), [(2, (2, ))])
+        rowid, r = database.get_by_pk("test_table", 3, row_format="namedtuple")
+        self.assertEqual((r.a, r.b, r.z), (3, 'C', '1967-08-11 12:34:45'))
+        self.assertEqual(tuple(r), ('C', 3, 1.23, 1.23, 3, b'c' * 150, '1967-08-11', '12:34:45', '1967-08-11 12:34:45'))
+        self.assertEqual([r.b for _, r in database.filter("test_table", {"c": 1}, row_format="namedtuple")], ['A'])
+        self.assertEqual(database.get_by_rowid("test_table", 1, columns=["x"], row_format="dict"), (1, {'x': '1967-08-11'}))
+        with self.assertRaises(ValueError):
+            database.get_by_rowid("test_table", 1, row_format="unknown")
+        database.close()
+
+        # column names which can't be namedtuple field names
+        r = schema._namedtuple(("_id", "from", "b"))(1, 2, 3)
+        self.assertEqual((r[0], r[1], r[2], r.b), (1, 2, 3, 3))
+
 
 class TestCell(TestBase):
     def test_first_payload_len(self):
@@ -878,8 +1219,42 @@ class TestCell(TestBase):
 
         test.close()
 
+    def test_first_payload_no_copy(self):
+        database = sqliteio.open("testdata/many_record333.sqlite")
+        leaf = database.pager.cursor(2).descend(100)[-1][0]
+        cell = leaf.cells[1]
+        self.assertEqual(cell.rowid, 100)
+        cell_payload = cell.cell_payload
+        self.assertTrue(isinstance(cell_payload.first_payload, memoryview))
+        self.assertEqual(cell_payload.overflow_pgno, 0)
+        self.assertTrue(cell_payload.get_payload_with_overflow() is cell_payload.first_payload)
+
+        # first_payload is a view of the page data
+        offset = cell.cell_pointer + 2     # payload length and rowid varints
+        self.assertEqual(bytes(cell_payload.first_payload), bytes(leaf.page.data[offset:offset+cell_payload.payload_len]))
+        header_size = leaf.page.data[offset]
+        leaf.page.data[offset] = header_size + 1
+        self.assertEqual(cell_payload.first_payload[0], header_size + 1)
+        leaf.page.data[offset] = header_size
+        database.close()
+
 
 class TestInsert(TestBase):
+    def test_no_index(self):
+        database = self._open_bytesio("testdata/pk_fk.sqlite")
+        self.assertEqual(database.index_schemas("fk_table"), None)
+        database.insert("fk_table", [{'id': None, 'fk': 40, 's': 'jkl'}])
+        database.update_by_rowid("fk_table", 1, {'s': 'xyz'})
+        self.assertEqual(
+            list(database.fetch_all("fk_table")), [
+                (1, {'id': 1, 'fk': 10, 's': 'xyz'}),
+                (2, {'id': 2, 'fk': 20, 's': 'def'}),
+                (3, {'id': 3, 'fk': 30, 's': 'ghi'}),
+                (4, {'id': 4, 'fk': 40, 's': 'jkl'}),
+            ]
+        )
+        database.close()
+
     def test_next_rowid(self):
         test = sqliteio.open("testdata/test.sqlite")
         table_schema = test.table_schema("test_table")
@@ -1069,6 +1444,72 @@ class TestInsert(TestBase):
         many_record.close()
         many_record_empty.close()
 
+    def test_insert_index_split(self):
+        database = self._open_bytesio("testdata/many_record_empty.sqlite")
+        for i in range(1, 1500):
+            database.insert("many_record_table", [{'a': None, 'b': i, 'c': '%04d' % (i * 7919 % 1000) * 6}])
+        index_schema = database.get_index_schema_by_name("many_record_idx_c")
+        # 3 levels index
+        cursor = database.pager.cursor(index_schema.pgno)
+        self.assertEqual(len(cursor.descend(['0000'], index_schema.orders)), 3)
+        records = [r for _, r in database.pager.records(index_schema.pgno)]
+        self.assertEqual(len(records), 1499)
+        self.assertEqual(records, sorted(records))
+        self.assertEqual(
+            [r["b"] for _, r in database.filter("many_record_table", {"c": '0007' * 6})],
+            [i for i in range(1, 1500) if i * 7919 % 1000 == 7]
+        )
+        database.close()
+
+    def test_append_insert(self):
+        database = self._open_bytesio("testdata/many_record_empty.sqlite")
+        table_schema = database.table_schema("many_record_table")
+        for i in range(1, 2001):
+            database.insert("many_record_table", [{'a': None, 'b': i, 'c': 'x' * (i % 50)}])
+        self.assertEqual(database._rightmost(table_schema)[1], 2000)
+        database.insert("many_record_table", [{'a': 3000, 'b': 3000, 'c': 'y'}])
+        database.insert("many_record_table", [{'a': None, 'b': 3001, 'c': 'y'}])
+        database.insert("many_record_table", [{'a': 2500, 'b': 2500, 'c': 'y'}])
+        self.assertEqual(
+            [r["b"] for _, r in database.fetch_all("many_record_table")],
+            list(range(1, 2001)) + [2500, 3000, 3001]
+        )
+        # all leaves are in the same depth
+        cursor = database.pager.cursor(table_schema.pgno)
+        depths = set()
+        valid = cursor.first()
+        while valid:
+            depths.add(len(cursor.stack))
+            valid = cursor.next()
+        self.assertEqual(depths, {3})
+
+        with self.assertRaises(ValueError):
+            database.insert("many_record_table", [{'a': 2500, 'b': 2500, 'c': 'y'}])
+        self.assertEqual(database._rightmost_cache, {})
+        database.close()
+
+    def test_bulk_load(self):
+        database = self._open_bytesio("testdata/many_record_empty.sqlite")
+        rows = [{'a': i, 'b': i, 'c': '%04d' % (i * 7919 % 1000) * 6} for i in range(3000, 0, -1)]
+        database.bulk_load("many_record_table", rows)
+        self.assertEqual([r["b"] for _, r in database.fetch_all("many_record_table")], list(range(1, 3001)))
+        table_schema = database.table_schema("many_record_table")
+        self.assertEqual(len(database.pager.cursor(table_schema.pgno).descend(1)), 3)
+        for index_name in ("many_record_idx_c", "many_record_idx_c_desc"):
+            index_schema = database.get_index_schema_by_name(index_name)
+            records = [r for _, r in database.pager.records(index_schema.pgno)]
+            self.assertEqual(len(records), 3000)
+            # rowid is always ascending
+            expected = sorted(sorted(records, key=lambda r: r[1]), key=lambda r: r[0], reverse=index_schema.orders[0] == -1)
+            self.assertEqual(records, expected)
+        self.assertEqual(
+            [r["b"] for _, r in database.filter("many_record_table", {"c": '0007' * 6})],
+            [i for i in range(1, 3001) if i * 7919 % 1000 == 7]
+        )
+        with self.assertRaises(ValueError):
+            database.bulk_load("many_record_table", [{'a': 3001, 'b': 0, 'c': ''}])
+        database.close()
+
 
 class TestDelete(TestBase):
     def test_delete_test(self):
@@ -1220,6 +1661,107 @@ class TestDelete(TestBase):
 
         large_row.close()
 
+    def test_delete_many(self):
+        database = self._open_bytesio("testdata/many_record_empty.sqlite")
+        table_schema = database.table_schema("many_record_table")
+        for i in range(1, 2001):
+            database.insert("many_record_table", [{'a': None, 'b': i, 'c': '%03d' % (i % 7) * (i % 40)}])
+        self.assertEqual(len(database.pager.cursor(table_schema.pgno).descend(1)), 3)
+
+        rest = [i for i in range(1, 2001) if i % 10 == 0]
+        for i in sorted(range(1, 2001), key=lambda i: i * 7919 % 2001):
+            if i % 10:
+                database.delete_by_rowid("many_record_table", i)
+        self.assertEqual([r["b"] for _, r in database.fetch_all("many_record_table")], rest)
+        self.assertEqual(
+            [r["b"] for _, r in database.filter("many_record_table", {"c": '003' * 10})],
+            [i for i in rest if i % 7 == 3 and i % 40 == 10]
+        )
+        for index_name in ("many_record_idx_c", "many_record_idx_c_desc"):
+            index_schema = database.get_index_schema_by_name(index_name)
+            self.assertEqual(sorted([r[1] for _, r in database.pager.records(index_schema.pgno)]), rest)
+        self.assertEqual(len(database.pager.cursor(table_schema.pgno).descend(1)), 2)
+        self.assertTrue(database.pager.num_freelist_pages > 0)
+
+        for i in rest:
+            database.delete_by_rowid("many_record_table", i)
+        self.assertEqual(list(database.fetch_all("many_record_table")), [])
+        self.assertEqual(len(database.pager.cursor(table_schema.pgno).descend(1)), 1)
+        database.close()
+
+    def test_delete_range(self):
+        database = self._open_bytesio("testdata/many_record_empty.sqlite")
+        table_schema = database.table_schema("many_record_table")
+        database.bulk_load("many_record_table", [{'a': i, 'b': i, 'c': '%03d' % (i % 7) * (i % 40)} for i in range(1, 3001)])
+        free_pages = database.pager.num_freelist_pages
+
+        database.delete_range("many_record_table", 101, 2900)
+        rest = list(range(1, 101)) + list(range(2901, 3001))
+        self.assertEqual([r["b"] for _, r in database.fetch_all("many_record_table")], rest)
+        for index_name in ("many_record_idx_c", "many_record_idx_c_desc"):
+            index_schema = database.get_index_schema_by_name(index_name)
+            self.assertEqual(sorted([r[1] for _, r in database.pager.records(index_schema.pgno)]), rest)
+        self.assertTrue(database.pager.num_freelist_pages > free_pages)
+        database.insert("many_record_table", [{'a': None, 'b': 3001, 'c': 'x'}])
+
+        # small ranges delete index records one by one
+        database.delete_range("many_record_table", None, 50)
+        database.delete_range("many_record_table", 2990)
+        rest = list(range(51, 101)) + list(range(2901, 2990))
+        self.assertEqual([r["b"] for _, r in database.fetch_all("many_record_table")], rest)
+        for index_name in ("many_record_idx_c", "many_record_idx_c_desc"):
+            index_schema = database.get_index_schema_by_name(index_name)
+            self.assertEqual(sorted([r[1] for _, r in database.pager.records(index_schema.pgno)]), rest)
+        database.delete_range("many_record_table")
+        self.assertEqual(list(database.fetch_all("many_record_table")), [])
+        self.assertEqual(len(database.pager.cursor(table_schema.pgno).descend(1)), 1)
+        database.close()
+
+    def test_truncate_and_drop_table(self):
+        database = self._open_bytesio("testdata/many_record_empty.sqlite")
+        rows = [{'a': i, 'b': i, 'c': 'x' * (i % 300)} for i in range(1, 1001)]
+        database.bulk_load("many_record_table", rows)
+        max_pgno = database.pager.max_pgno
+
+        database.truncate("many_record_table")
+        self.assertEqual(list(database.fetch_all("many_record_table")), [])
+        for index_schema in database.index_schemas("many_record_table"):
+            self.assertEqual(list(database.pager.records(index_schema.pgno)), [])
+        database.bulk_load("many_record_table", rows)
+        self.assertEqual(database.pager.max_pgno, max_pgno)
+
+        schema_cookie = database.pager.schema_cookie
+        database.drop_table("many_record_table")
+        self.assertEqual(database.table_schema("many_record_table"), None)
+        self.assertEqual(database.index_schemas("many_record_table"), None)
+        self.assertEqual([r for _, r in database.pager.records(1) if r[2] == "many_record_table"], [])
+        self.assertEqual(database.pager.schema_cookie, schema_cookie + 1)
+        # all pages except sqlite_master are free
+        self.assertEqual(database.pager.num_freelist_pages, database.pager.max_pgno - 1)
+        database.close()
+
+    def test_truncate_and_drop_table_rollback(self):
+        database = self._open_bytesio("testdata/many_record_empty.sqlite")
+        rows = [{'a': i, 'b': i, 'c': 'x' * (i % 300)} for i in range(1, 1001)]
+        database.bulk_load("many_record_table", rows)
+        database.commit()
+        max_pgno = database.pager.max_pgno
+
+        def add_to_freelist(page):
+            raise OSError("no space left")
+        database.pager.add_to_freelist = add_to_freelist
+        with self.assertRaises(OSError):
+            database.truncate("many_record_table")
+        with self.assertRaises(OSError):
+            database.drop_table("many_record_table")
+        del database.pager.add_to_freelist
+
+        # dirty pages are discarded
+        self.assertEqual(database.pager.pages, {})
+        self.assertEqual(database.pager.max_pgno, max_pgno)
+        self.assertEqual([r["b"] for _, r in database.fetch_all("many_record_table")], list(range(1, 1001)))
+        database.close()
+
 
 class TestUpdate(TestBase):
     def test_simple_update(self):
@@ -1257,6 +1799,288 @@ class TestUpdate(TestBase):
         database.close()
 
 
+class TestJournal(TestBase):
+    def test_journal_mode(self):
+        with self.assertRaises(ValueError):
+            sqliteio.open("testdata/test.sqlite", journal_mode="unknown")
+
+    def test_commit(self):
+        self._copy("testdata/test.sqlite", "testdata/journal.sqlite")
+        database = sqliteio.open("testdata/journal.sqlite")
+        database.delete_by_rowid("test_table", 1)
+        database.commit()
+        with self.assertRaises(OSError):
+            os.stat("testdata/journal.sqlite-journal")
+        database.close()
+
+        database = sqliteio.open("testdata/journal.sqlite")
+        test1 = sqliteio.open("testdata/test1.sqlite")
+        self.assertEqual(list(database.fetch_all("test_table")), list(test1.fetch_all("test_table")))
+        test1.close()
+        database.close()
+        os.remove("testdata/journal.sqlite")
+
+    def test_hot_journal(self):
+        self._copy("testdata/test.sqlite", "testdata/journal.sqlite")
+        database = sqliteio.open("testdata/journal.sqlite")
+        database.delete_by_rowid("test_table", 1)
+        database.insert("test_table", [
+            {'a': None, 'b': 'E', 'c': 5, 'd': 1.23, 'e': 1.23, 'w': b'e' * 500, 'x': '1967-08-11', 'y': '12:34:45', 'z': '1967-08-11 12:34:45'},
+        ])
+
+        # crash after first write
+        write_run = database.pager.vfs._write_run
+
+        def crash(offset, buffers):
+            write_run(offset, buffers)
+            raise OSError("crash")
+        database.pager.vfs._write_run = crash
+        with self.assertRaises(OSError):
+            database.commit()
+        database.close()
+        os.stat("testdata/journal.sqlite-journal")
+
+        # rollback by hot journal
+        database = sqliteio.open("testdata/journal.sqlite")
+        with self.assertRaises(OSError):
+            os.stat("testdata/journal.sqlite-journal")
+        test = sqliteio.open("testdata/test.sqlite")
+        self.assertEqual(database.pager.max_pgno, test.pager.max_pgno)
+        self.assertEqualDB(database, test)
+        test.close()
+        database.close()
+        os.remove("testdata/journal.sqlite")
+
+    def test_no_file_name(self):
+        self._copy("testdata/test.sqlite", "testdata/journal.sqlite")
+        vfs = sqliteio.FileVFS(open("testdata/journal.sqlite", "r+b"))
+        vfs.name = None
+        database = sqliteio.open(None, vfs=vfs)
+        database.delete_by_rowid("test_table", 1)
+        # no crash protection without the journal
+        with self.assertRaises(ValueError):
+            database.commit()
+        database.close()
+
+        vfs = sqliteio.FileVFS(open("testdata/journal.sqlite", "r+b"))
+        vfs.name = None
+        database = sqliteio.open(None, vfs=vfs, journal_mode="off")
+        database.delete_by_rowid("test_table", 1)
+        database.commit()
+        database.close()
+
+        vfs = sqliteio.FileVFS(open("testdata/wal.sqlite", "rb"))
+        vfs.name = None
+        with self.assertRaises(ValueError):
+            sqliteio.open(None, vfs=vfs)
+        os.remove("testdata/journal.sqlite")
+
+    def test_busy(self):
+        try:
+            import sqlite3  # noqa: F401
+            import subprocess
+            import sys
+        except ImportError:
+            self.skipTest("sqlite3 module is not available")
+        self._copy("testdata/test.sqlite", "testdata/journal.sqlite")
+        # another process keeps SHARED lock
+        proc = subprocess.Popen([sys.executable, "-c", "\n".join([
+            "import sqlite3, sys",
+            "conn = sqlite3.connect('testdata/journal.sqlite', isolation_level=None)",
+            "conn.execute('begin')",
+            "conn.execute('select count(*) from test_table').fetchall()",
+            "print('ready', flush=True)",
+            "sys.stdin.readline()",
+            "conn.execute('commit')",
+        ])], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        database = sqliteio.open("testdata/journal.sqlite")
+        database.pager.vfs.busy_timeout = 0.1
+        database.delete_by_rowid("test_table", 1)
+        try:
+            self.assertEqual(proc.stdout.readline(), "ready\n")
+            with self.assertRaises(sqliteio.BusyError):
+                database.commit()
+        finally:
+            proc.communicate("\n")
+        database.commit()
+        database.close()
+
+        database = sqliteio.open("testdata/journal.sqlite")
+        test1 = sqliteio.open("testdata/test1.sqlite")
+        self.assertEqual(list(database.fetch_all("test_table")), list(test1.fetch_all("test_table")))
+        test1.close()
+        database.close()
+        os.remove("testdata/journal.sqlite")
+
+    def test_live_journal(self):
+        try:
+            import sqlite3
+            import subprocess
+            import sys
+        except ImportError:
+            self.skipTest("sqlite3 module is not available")
+        self._copy("testdata/test.sqlite", "testdata/journal.sqlite")
+
+        def open_database():
+            vfs = sqliteio.FileVFS(open("testdata/journal.sqlite", "r+b"), "testdata/journal.sqlite")
+            vfs.busy_timeout = 0.1
+            return sqliteio.open(None, vfs=vfs)
+
+        # another process in the middle of a transaction
+        proc = subprocess.Popen([sys.executable, "-c", "\n".join([
+            "import sqlite3, sys",
+            "conn = sqlite3.connect('testdata/journal.sqlite', isolation_level=None)",
+            "conn.execute('pragma cache_size=2')",
+            "conn.execute('begin immediate')",
+            "conn.execute('delete from test_table where rowid = 1')",
+            "print('reserved', flush=True)",
+            "sys.stdin.readline()",
+            # spill dirty pages to the database file after the journal is synced
+            "for i in range(100):",
+            "    conn.execute('insert into test_table (b, w) values (?, ?)', ('F', b'f' * 1000))",
+            "print('exclusive', flush=True)",
+            "sys.stdin.readline()",
+            "conn.execute('commit')",
+        ])], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        try:
+            self.assertEqual(proc.stdout.readline(), "reserved\n")
+            os.stat("testdata/journal.sqlite-journal")
+            database = open_database()
+            self.assertTrue(database.pager.vfs.check_reserved_lock())
+            os.stat("testdata/journal.sqlite-journal")
+            database.close()
+
+            proc.stdin.write("\n")
+            proc.stdin.flush()
+            self.assertEqual(proc.stdout.readline(), "exclusive\n")
+            database = open_database()
+            # the live journal is not played back
+            os.stat("testdata/journal.sqlite-journal")
+            database.close()
+        finally:
+            proc.communicate("\n")
+        self.assertEqual(proc.returncode, 0)
+
+        conn = sqlite3.connect("testdata/journal.sqlite")
+        self.assertEqual(conn.execute("pragma integrity_check").fetchall(), [("ok", )])
+        self.assertEqual(conn.execute("select count(*) from test_table").fetchall(), [(103, )])
+        conn.close()
+        os.remove("testdata/journal.sqlite")
+
+
+class TestWAL(TestBase):
+    def test_read(self):
+        database = sqliteio.open(None, vfs=sqliteio.FileVFS(open("testdata/wal.sqlite", "rb"), "testdata/wal.sqlite"))
+        self.assertTrue(len(database.pager.wal.frames) > 0)
+        rows = list(database.fetch_all("many_record_table"))
+        self.assertEqual([r[0] for r in rows], list(range(11, 667)))
+        self.assertEqual(rows[-1], (666, {'a': 666, 'b': 666, 'c': 'abcdefghijklmnopqrstuvwxyz'}))
+        self.assertEqual(database.get_by_rowid("many_record_table", 10), None)
+        self.assertEqual(database.get_by_rowid("many_record_table", 334)[1]['c'], 'abcdefghijklmnopqrstuvwxyz')
+        self.assertEqual(
+            [r[0] for r in database.filter("many_record_table", {"c": 'abcdefghijklmnopqrstuvwxyz'})],
+            list(range(334, 667))
+        )
+        database.close()
+
+    def test_write(self):
+        self._copy("testdata/wal.sqlite", "testdata/wal_write.sqlite")
+        self._copy("testdata/wal.sqlite-wal", "testdata/wal_write.sqlite-wal")
+        database = sqliteio.open("testdata/wal_write.sqlite")
+        db_file_size = os.stat("testdata/wal_write.sqlite")[6]
+        wal_file_size = os.stat("testdata/wal_write.sqlite-wal")[6]
+        database.delete_by_rowid("many_record_table", 11)
+        database.commit()
+        # appended to WAL file
+        self.assertEqual(os.stat("testdata/wal_write.sqlite")[6], db_file_size)
+        self.assertTrue(os.stat("testdata/wal_write.sqlite-wal")[6] > wal_file_size)
+        database.close()
+
+        database = sqliteio.open("testdata/wal_write.sqlite")
+        self.assertEqual([r[0] for r in database.fetch_all("many_record_table")], list(range(12, 667)))
+        database.checkpoint()
+        self.assertEqual(os.stat("testdata/wal_write.sqlite-wal")[6], 0)
+        database.close()
+
+        database = sqliteio.open("testdata/wal_write.sqlite")
+        self.assertEqual(database.pager.wal.frames, {})
+        self.assertEqual([r[0] for r in database.fetch_all("many_record_table")], list(range(12, 667)))
+        database.close()
+        os.remove("testdata/wal_write.sqlite")
+        os.remove("testdata/wal_write.sqlite-wal")
+
+    def test_to_wal_mode(self):
+        self._copy("testdata/test.sqlite", "testdata/wal_write.sqlite")
+        database = sqliteio.open("testdata/wal_write.sqlite", journal_mode="wal")
+        database.delete_by_rowid("test_table", 1)
+        database.commit()
+        database.close()
+
+        database = sqliteio.open("testdata/wal_write.sqlite")
+        self.assertTrue(database.pager.wal is not None)
+        test1 = sqliteio.open("testdata/test1.sqlite")
+        self.assertEqual(list(database.fetch_all("test_table")), list(test1.fetch_all("test_table")))
+        test1.close()
+        database.close()
+        os.remove("testdata/wal_write.sqlite")
+        os.remove("testdata/wal_write.sqlite-wal")
+
+    def test_restarted(self):
+        self._copy("testdata/wal.sqlite", "testdata/wal_write.sqlite")
+        self._copy("testdata/wal.sqlite-wal", "testdata/wal_write.sqlite-wal")
+        database = sqliteio.open("testdata/wal_write.sqlite")
+        wal = database.pager.wal
+        pgnos = sorted(wal.frames.keys())
+
+        # another connection checkpoints and restarts the WAL
+        other = sqliteio.open("testdata/wal_write.sqlite")
+        other.checkpoint()
+        other.delete_by_rowid("many_record_table", 11)
+        other.commit()
+        other.close()
+
+        latest = sqliteio.open("testdata/wal_write.sqlite")
+        for pgno in pgnos:
+            self.assertEqual(wal.read_page(pgno), latest.pager.wal.read_page(pgno))
+        self.assertEqual(wal.frames, latest.pager.wal.frames)
+        latest.close()
+        database.close()
+        os.remove("testdata/wal_write.sqlite")
+        os.remove("testdata/wal_write.sqlite-wal")
+
+    def test_grow(self):
+        try:
+            import sqlite3
+        except ImportError:
+            self.skipTest("sqlite3 module is not available")
+        for path in ("testdata/wal_grow.sqlite", "testdata/wal_grow.sqlite-wal"):
+            if os.path.exists(path):
+                os.remove(path)
+        conn = sqlite3.connect("testdata/wal_grow.sqlite")
+        conn.execute("pragma journal_mode=wal")
+        conn.execute("create table many_record_table (a integer primary key, b integer, c text)")
+        conn.commit()
+        conn.close()
+
+        database = sqliteio.open("testdata/wal_grow.sqlite")
+        database.insert("many_record_table", [{'a': None, 'b': 0, 'c': 'abcdefghijklmnopqrstuvwxyz'}])
+        database.commit()
+        # grow database without changing page 1
+        database.insert("many_record_table", [
+            {'a': None, 'b': i, 'c': 'abcdefghijklmnopqrstuvwxyz'} for i in range(1, 1000)
+        ])
+        database.commit()
+        database.close()
+
+        conn = sqlite3.connect("testdata/wal_grow.sqlite")
+        self.assertEqual(conn.execute("pragma integrity_check").fetchall(), [("ok", )])
+        self.assertEqual(conn.execute("select count(*) from many_record_table").fetchall(), [(1000, )])
+        conn.close()
+        os.remove("testdata/wal_grow.sqlite")
+        if os.path.exists("testdata/wal_grow.sqlite-wal"):
+            os.remove("testdata/wal_grow.sqlite-wal")
+
+
 class TestOpen(TestBase):
     def test_readobly(self):
         fileobj = open("testdata/test.sqlite", "rb")
@@ -1293,6 +2117,50 @@ class TestOpen(TestBase):
             test1.close()
             test.close()
 
+    def test_mmap(self):
+        self._copy("testdata/many_record_empty.sqlite", "testdata/mmap.sqlite")
+
+        database = sqliteio.open("testdata/mmap.sqlite", mmap=True)
+        self.assertTrue(isinstance(database.pager.get_page(2).data, memoryview))
+        for i in range(1, 334):
+            database.insert("many_record_table", [{'a': None, 'b': i, 'c': 'aaaaaaaaaaaaaaaaaaaaaaaaaa'}])
+        self.assertTrue(isinstance(database.pager.get_page(2).data, bytearray))
+        database.commit()
+        self.assertEqual(len(list(database.fetch_all("many_record_table"))), 333)
+        database.close()
+
+        database = sqliteio.open("testdata/mmap.sqlite", mmap=True)
+        self.assertEqual(
+            [r["b"] for _, r in database.fetch_all("many_record_table")],
+            list(range(1, 334))
+        )
+        database.close()
+        os.remove("testdata/mmap.sqlite")
+
+    def test_memory_vfs(self):
+        with open("testdata/test.sqlite", "rb") as f:
+            data = f.read()
+        database = sqliteio.open("testdata/test.sqlite", vfs="memory")
+        self.assertTrue(isinstance(database.pager.vfs, sqliteio.MemoryVFS))
+        database.delete_by_rowid("test_table", 1)
+        database.commit()
+        test1 = sqliteio.open("testdata/test1.sqlite")
+        self.assertEqualDB(database, test1)
+        test1.close()
+        database.close()
+        # database file is not changed
+        with open("testdata/test.sqlite", "rb") as f:
+            self.assertEqual(f.read(), data)
+
+        # custom storage backend
+        vfs = sqliteio.MemoryVFS(data)
+        database = sqliteio.open(None, vfs=vfs)
+        database.delete_by_rowid("test_table", 1)
+        database.commit()
+        self.assertEqual(database.pager.vfs, vfs)
+        self.assertNotEqual(bytes(vfs.data), data)
+        database.close()
+
 
 if __name__ == "__main__":
     unittest.main()